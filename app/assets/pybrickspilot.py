@@ -24,6 +24,14 @@ Usage:
 
 # MicroPython compatible imports
 import ujson as json
+import ustruct as struct
+from umath import cos, pi, sin, sqrt
+
+try:
+    from ubinascii import b2a_base64
+except ImportError:
+    # Not every firmware build ships ubinascii; binary frames fall back to hex
+    b2a_base64 = None
 
 from pybricks.tools import StopWatch
 from pybricks.tools import read_input_byte
@@ -43,6 +51,7 @@ def get_time_ms():
 # Global registry for hardware components
 _hub = None
 _motors = {}
+_motor_names = []  # Motor names in registration order (binary command indices)
 _sensors = {}
 _drivebase = None
 _gyro_sensor = None
@@ -51,8 +60,61 @@ _gyro_sensor = None
 _telemetry_enabled = True
 _telemetry_interval_ms = 100  # Send telemetry every 100ms
 _last_telemetry_time = 0
+_telemetry_format = "json"  # json, rows or binary
+_telemetry_schema = None  # Positional row schema, rebuilt after registration
+_telemetry_schema_id = 0
+_telemetry_delta = False  # Send only changed fields between keyframes
+_telemetry_keyframe_interval = 20  # Ticks between full keyframes
+_telemetry_epsilons = {}  # Field path or device prefix -> minimum change to send
+_telemetry_last_sent = None  # Quantized row as last sent, None forces a keyframe
+_telemetry_ticks_since_keyframe = 0
+_telemetry_seq = 0
+_telemetry_batch_size = 1  # Samples per batched message, 1 disables batching
+_telemetry_batch = None  # Preallocated sample buffer for the current schema
+_telemetry_batch_count = 0
+_telemetry_batch_start = 0  # Timestamp of the first sample in the batch
+_telemetry_schedule = "skip"  # skip or catch_up when the loop misses deadlines
+_telemetry_stats = None  # Timing statistics for background_telemetry_task
 # Command buffer for non-blocking input processing
-_command_buffer = ""
+# Longest command line accepted, in bytes; longer lines are dropped with a
+# COMMAND_OVERFLOW alert. Longer sequences arrive in sequence_append chunks.
+_COMMAND_BUFFER_SIZE = 4096
+_command_buffer = bytearray(_COMMAND_BUFFER_SIZE)
+_command_length = 0  # Bytes of the current, incomplete line
+_command_overflow = False  # Current line exceeded the buffer; drop to newline
+_command_read_budget = 256  # Bytes read between yields, adapted to input rate
+# Concurrent command execution (background_command_task)
+COMMAND_POLL_MS = 10  # Reader, executor and cancel-watch period
+_command_queue = []  # (command, received ms) waiting for the executor, oldest first
+_command_running = False  # Executor is running a command or sequence
+_command_cancel = False  # Abort the running command at the next poll
+_command_generation = 0  # Bumped by every cancel; a change means a stop landed
+# Emergency stop: a single CAN byte (0x18) anywhere in the input stream.
+# Raw control characters never appear in valid JSON, so it cannot collide
+# with a command line.
+EMERGENCY_STOP_BYTE = 0x18
+_command_discard = False  # Drop the rest of a line cut by an emergency stop
+_emergency_stop_count = 0  # Bumped on every emergency stop; watched by programs
+# Binary command frames: STX, uint16 payload length, payload
+COMMAND_FRAME_START = 0x02
+_command_format = "json"  # json, or binary once negotiated for this session
+_command_frame_header = 0  # Length bytes still expected after STX
+_command_frame_remaining = 0  # Payload bytes still expected in a binary frame
+# A frame with a longer gap between bytes is abandoned, so a truncated frame
+# cannot swallow later lines or the emergency stop byte
+COMMAND_FRAME_TIMEOUT_MS = 100
+_command_frame_updated = 0  # When the last byte of the current frame arrived
+# Teleop: latest drive_continuous target applied at a fixed control rate
+_teleop_enabled = False
+_teleop_rate_ms = 20  # Control period
+_teleop_timeout_ms = 500  # Dead-man timeout: stop without a fresh update
+_teleop_target = None  # (speed, turn_rate) from the newest update, or None
+_teleop_updated = 0  # Hub time of the newest update
+_command_executor_active = False  # background_command_task is executing
+# Chunked sequence upload (sequence_begin / sequence_append / sequence_commit)
+_SEQUENCE_STREAM_TIMEOUT_MS = 5000  # Abort when no chunk arrives for this long
+_SEQUENCE_STREAM_ACTIONS = ("sequence_begin", "sequence_append", "sequence_commit")
+_sequence_stream = None  # Stream being received and executed, or None
 
 # Hub menu state management
 _menu_programs = []  # List of program dictionaries
@@ -83,6 +145,7 @@ def register_hub(hub):
     """Register the main hub for battery and IMU telemetry."""
     global _hub
     _hub = hub
+    _register_hub_plans(hub)
     print("[PILOT] Registered hub")
 
 
@@ -90,20 +153,58 @@ def register_motor(name, motor):
     """Register a motor for telemetry and remote control."""
     global _motors
     _motors[name] = motor
+    if name not in _motor_names:
+        _motor_names.append(name)
+    _set_plan("motors." + name, _motor_plan(motor))
     print("[PILOT] Registered motor '" + name + "'")
 
 
-def register_sensor(name, sensor):
-    """Register a sensor for telemetry."""
+def register_sensor(name, sensor, color_mode=None):
+    """Register a sensor for telemetry.
+
+    For color sensors, color_mode selects how telemetry samples the sensor's
+    hardware modes; see set_color_sensor_mode.
+    """
     global _sensors
     _sensors[name] = sensor
+    if color_mode is not None:
+        _color_sensor_modes[name] = color_mode
+    _set_plan(
+        "sensors." + name,
+        _sensor_plan(sensor, _color_sensor_modes.get(name, "all")),
+    )
     print("[PILOT] Registered sensor '" + name + "'")
 
 
+def set_color_sensor_mode(name, mode):
+    """Choose how telemetry samples a registered color sensor.
+
+    Each of color(), reflection() and ambient() is a separate hardware mode,
+    and every switch costs latency and disturbs the user program's own reads.
+
+    Args:
+        name: Registered sensor name.
+        mode: "all" reads every mode each tick, "rotate" reads one mode per
+            tick in turn, and "color", "reflection" or "ambient" reads only
+            that mode, so a line follower using reflection() never switches.
+    """
+    if mode not in _COLOR_SENSOR_MODES:
+        print("[PILOT] Unknown color sensor mode:", mode)
+        return
+    if name not in _sensors:
+        print("[PILOT] Unknown sensor:", name)
+        return
+    _color_sensor_modes[name] = mode
+    _set_plan("sensors." + name, _sensor_plan(_sensors[name], mode))
+    print("[PILOT] Color sensor '" + name + "' sampling mode:", mode)
+
+
 def register_drivebase(drivebase):
     """Register a drivebase for remote control."""
     global _drivebase
     _drivebase = drivebase
+    invalidate_drivebase_settings()
+    _set_plan("drivebase", _drivebase_plan(drivebase))
     print("[PILOT] Registered drivebase")
 
 
@@ -111,6 +212,7 @@ def register_gyro(gyro_sensor):
     """Register a gyro sensor for enhanced IMU data."""
     global _gyro_sensor
     _gyro_sensor = gyro_sensor
+    _set_plan("hub.gyro", _gyro_plan(gyro_sensor))
     print("[PILOT] Registered gyro sensor")
 
 
@@ -122,212 +224,982 @@ def set_telemetry_enabled(enabled=True):
 
 
 def set_telemetry_interval(interval_ms):
-    """Set the telemetry transmission interval in milliseconds."""
+    """Set the telemetry transmission interval in milliseconds.
+
+    JSON frames are limited to one every 50ms; the compact formats are small
+    enough to go down to 10ms.
+    """
     global _telemetry_interval_ms
-    _telemetry_interval_ms = max(50, interval_ms)  # Minimum 50ms
+    minimum_ms = 50 if _telemetry_format == "json" else 10
+    _telemetry_interval_ms = max(minimum_ms, interval_ms)
     print("[PILOT] Telemetry interval set to", _telemetry_interval_ms, "ms")
 
 
-def _get_motor_telemetry():
-    """Collect telemetry data from all registered motors."""
-    motor_data = {}
+def set_telemetry_format(telemetry_format="json"):
+    """Select the telemetry encoding: "json", "rows" or "binary".
 
-    for name, motor in _motors.items():
-        try:
-            motor_data[name] = {
-                "angle": float(motor.angle()),
-                "speed": float(motor.speed()),
-            }
+    "json" sends the full nested dict every tick. "rows" and "binary" send a
+    flat positional row after a one-time [PILOT:TELEMETRY_SCHEMA] message.
+    """
+    global _telemetry_format
+    if telemetry_format not in ("json", "rows", "binary"):
+        print("[PILOT] Unknown telemetry format:", telemetry_format)
+        return
+    _telemetry_format = telemetry_format
+    # Field-level subscriptions only apply to the compact formats; this also
+    # re-announces the schema so the browser can decode the rows that follow
+    _activate_plans()
+    if telemetry_format == "json" and _telemetry_interval_ms < 50:
+        set_telemetry_interval(_telemetry_interval_ms)
+    print("[PILOT] Telemetry format set to", telemetry_format)
+
+
+def _invalidate_telemetry_schema():
+    """Drop the cached schema so it is rebuilt and announced on the next row."""
+    global _telemetry_schema, _telemetry_batch
+    # Pending samples were collected under the old schema, so send them first
+    _flush_telemetry_batch()
+    _telemetry_batch = None
+    _telemetry_schema = None
+
+
+def _sensor_kind(sensor):
+    """Classify a sensor by the methods it exposes."""
+    if hasattr(sensor, "color"):
+        return "color"
+    if hasattr(sensor, "distance"):
+        return "ultrasonic"
+    if hasattr(sensor, "force"):
+        return "force"
+    if hasattr(sensor, "angle"):
+        return "rotation"
+    return "generic"
+
+
+# Device reader plans
+#
+# Registration probes each device once and stores a plan: its kind, whether
+# its readers must be awaited, the bound reader methods (each filling `width`
+# consecutive fields, None for a capability the device lacks) and the
+# function that shapes the values into the legacy JSON dict. A telemetry
+# tick then just runs the plans, with no hasattr chains or failing calls.
+#
+# Each plan lives in a mutable entry that also carries its sampling period
+# (see set_telemetry_rate), when it is next due, its last values (or the
+# exception from the last read) and the cached JSON shape of those values.
+# Every frame merges freshly sampled plans with the cached values of the rest.
+#
+# The entry's active plan is what is actually sampled under the current
+# subscription (see set_telemetry_subscription): None when the device is not
+# subscribed, and in the compact formats a copy of the plan with the readers
+# of unsubscribed fields removed.
+
+TELEMETRY_ONCE = -1  # Sampling period for values that never change
+
+# Device prefix ("sensors.us") or section ("motors") -> sampling period in ms.
+# 0 samples every tick; unlisted devices use 0.
+_telemetry_rates = {"hub.battery": 1000, "hub.system": TELEMETRY_ONCE}
+
+# [prefix, (kind, is_async, readers, shaper), period_ms, next_due_ms, values,
+#  shaped, active plan] in registration order
+_plans = []
+
+_telemetry_subscription = None  # Subscribed paths, None for everything
+
+_COLOR_SENSOR_MODES = ("all", "rotate", "color", "reflection", "ambient")
+_color_sensor_modes = {}  # Sensor name -> color sampling mode, default "all"
+
+
+def _set_plan(prefix, plan):
+    """Add, replace or (with plan=None) remove the plan for a device prefix."""
+    entry = [prefix, plan, _telemetry_period(prefix), 0, None, None, None]
+    if plan is not None:
+        _activate_plan(entry)
+    for i in range(len(_plans)):
+        if _plans[i][0] == prefix:
+            if plan is None:
+                _plans.pop(i)
+            else:
+                _plans[i] = entry
+            break
+    else:
+        if plan is not None:
+            _plans.append(entry)
+    _invalidate_telemetry_schema()
 
-            # Try to get control data if motor supports it
-            try:
-                motor_data[name]["load"] = float(motor.load())
-            except:
-                pass
 
-        except Exception as e:
-            motor_data[name] = {"error": str(e)}
+def set_telemetry_rate(key, period_ms):
+    """Set how often a device or section is sampled.
 
-    return motor_data
+    Args:
+        key: A device prefix such as "sensors.us", "motors.left", "hub.battery"
+            or "drivebase", or a whole section: "motors", "sensors" or "hub".
+        period_ms: Sampling period; 0 samples every telemetry tick and
+            TELEMETRY_ONCE samples a single time. Devices cannot be sampled
+            faster than the telemetry interval.
+    """
+    if period_ms == "once":
+        period_ms = TELEMETRY_ONCE
+    _telemetry_rates[key] = period_ms
+    for entry in _plans:
+        entry[2] = _telemetry_period(entry[0])
+        entry[3] = 0
+    print("[PILOT] Telemetry rate for", key, "set to", period_ms, "ms")
 
 
-async def _get_sensor_telemetry():
-    """Collect telemetry data from all registered sensors."""
-    sensor_data = {}
+def set_telemetry_subscription(paths=None):
+    """Limit telemetry to the devices and fields the browser needs.
 
-    for name, sensor in _sensors.items():
-        try:
-            # Try common sensor methods
-            if hasattr(sensor, "color"):
-                try:
-                    color_value = await sensor.color(True)
-                    sensor_data[name] = {
-                        "type": "color",
-                        "color": str(color_value),  # Convert Color enum to string
-                    }
-                    if hasattr(sensor, "reflection"):
-                        try:
-                            reflection_value = await sensor.reflection()
-                            if isinstance(reflection_value, (int, float)):
-                                sensor_data[name]["reflection"] = float(
-                                    reflection_value
-                                )
-                        except Exception as e:
-                            sensor_data[name]["reflection_error"] = str(e)
-                    if hasattr(sensor, "ambient"):
-                        try:
-                            ambient_value = await sensor.ambient()
-                            if isinstance(ambient_value, (int, float)):
-                                sensor_data[name]["ambient"] = float(ambient_value)
-                        except Exception as e:
-                            sensor_data[name]["ambient_error"] = str(e)
-                except Exception as e:
-                    sensor_data[name] = {
-                        "type": "color",
-                        "error": f"Color read error: {str(e)}",
-                    }
+    Args:
+        paths: Sections ("motors"), devices ("hub.imu", "drivebase") or fields
+            ("hub.imu.heading", "motors.arm.load"); None or empty for
+            everything. Unsubscribed devices are neither sampled nor sent. In
+            the rows and binary formats this also applies to single fields;
+            JSON frames include every field of a subscribed device.
+    """
+    global _telemetry_subscription
+    _telemetry_subscription = list(paths) if paths else None
+    _activate_plans()
+    print("[PILOT] Telemetry subscription:", _telemetry_subscription or "all")
 
-            elif hasattr(sensor, "distance"):
-                try:
-                    distance_value = None
-
-                    try:
-                        distance_value = await sensor.distance()
-                    except (TypeError, AttributeError):
-                        distance_value = f"All methods failed: {str(e2)}, {str(e3)}"
-
-                    # Ensure we have a numeric value, not a string or wait object
-                    if isinstance(distance_value, (int, float)):
-                        sensor_data[name] = {
-                            "type": "ultrasonic",
-                            "distance": float(distance_value),
-                        }
-                    else:
-                        sensor_data[name] = {
-                            "type": "ultrasonic",
-                            "error": f"Invalid distance value: {distance_value}",
-                            "raw_value": str(distance_value),
-                        }
-                except Exception as e:
-                    sensor_data[name] = {
-                        "type": "ultrasonic",
-                        "error": f"Distance read error: {str(e)}",
-                    }
-
-            elif hasattr(sensor, "force"):
-                sensor_data[name] = {
-                    "type": "force",
-                    "force": float(await sensor.force()),
-                    "pressed": bool(await sensor.pressed()),
-                }
 
-            elif hasattr(sensor, "angle"):
-                sensor_data[name] = {
-                    "type": "rotation",
-                    "angle": float(await sensor.angle()),
-                    "speed": (
-                        float(await sensor.speed())
-                        if hasattr(sensor, "speed")
-                        else None
-                    ),
-                }
+def _is_subscribed(path):
+    """True if the path, one of its parents or one of its fields is subscribed."""
+    if _telemetry_subscription is None:
+        return True
+    for item in _telemetry_subscription:
+        if path == item or path.startswith(item + ".") or item.startswith(path + "."):
+            return True
+    return False
 
-            else:
-                # Generic sensor - try to get any available data
-                sensor_data[name] = {
-                    "type": "generic",
-                    "value": str(sensor),
-                }
 
-        except Exception as e:
-            sensor_data[name] = {"type": "error", "error": str(e)}
+def _activate_plans():
+    """Recompute every entry's active plan and rebuild the schema."""
+    for entry in _plans:
+        _activate_plan(entry)
+    _invalidate_telemetry_schema()
 
-    return sensor_data
 
+def _activate_plan(entry):
+    """Derive the plan actually sampled for an entry under the subscription."""
+    prefix, plan = entry[0], entry[1]
+    # Cached values may lack fields the new active plan reads; resample
+    entry[3] = 0
+    entry[4] = None
+    entry[5] = None
 
-def _get_hub_telemetry():
-    """Collect telemetry data from the hub."""
-    hub_data = {}
+    if not _is_subscribed(prefix):
+        entry[6] = None
+        return
+    fields = _GROUP_FIELDS[plan[0]]
+    if _telemetry_subscription is None or _telemetry_format == "json" or not fields:
+        entry[6] = plan
+        return
 
-    if _hub is None:
-        return hub_data
+    readers = []
+    start = 0
+    for method, width in plan[2]:
+        keep = False
+        for name, code, scale in fields[start : start + width]:
+            if _is_subscribed(prefix + "." + name):
+                keep = True
+        readers.append((method if keep else None, width))
+        start += width
+    entry[6] = (plan[0], plan[1], tuple(readers), plan[3])
 
-    try:
-        # Battery information
-        if hasattr(_hub, "battery"):
-            battery = _hub.battery
-            hub_data["battery"] = {
-                "voltage": battery.voltage(),
-                "current": battery.current(),
-            }
 
-        # IMU data
-        if hasattr(_hub, "imu"):
-            imu = _hub.imu
-            try:
-                # Start with just heading data (simple float)
-                imu_data = {}
+def _telemetry_period(prefix):
+    """Resolve a device's sampling period from the rate table."""
+    period = _telemetry_rates.get(prefix)
+    if period is None:
+        period = _telemetry_rates.get(prefix.split(".", 1)[0], 0)
+    return period
 
-                # Heading is a simple float - should work fine
-                try:
-                    imu_data["heading"] = float(imu.heading())
-                except Exception as he:
-                    imu_data["heading_error"] = str(he)
 
-                # Try to get acceleration data using simple indexing
-                try:
-                    acc = imu.acceleration()
-                    # Try to access as if it's indexable
-                    imu_data["acceleration"] = [acc[0], acc[1], acc[2]]
-                except Exception as ae:
-                    # Skip acceleration data if Matrix conversion fails
-                    imu_data["acceleration_error"] = "Matrix conversion not supported"
-
-                # Try to get angular velocity data
-                try:
-                    ang = imu.angular_velocity()
-                    # Try to access as if it's indexable
-                    imu_data["angular_velocity"] = [ang[0], ang[1], ang[2]]
-                except Exception as ave:
-                    # Skip angular velocity data if Matrix conversion fails
-                    imu_data["angular_velocity_error"] = (
-                        "Matrix conversion not supported"
-                    )
+async def _sample_due_plans(entries, now):
+    """Read every plan entry that is due and cache its values.
 
-                hub_data["imu"] = imu_data
+    Plans with awaitable readers (sensors) are read concurrently, so a tick
+    costs the latency of the slowest sensor instead of the sum of all of them.
+    """
+    concurrent = []
+    for entry in entries:
+        period = entry[2]
+        if entry[6] is None:
+            continue
+        cached = entry[4]
+        if cached is not None and (period < 0 or now < entry[3]):
+            # A read-once entry whose read failed is retried next tick
+            if not (period < 0 and isinstance(cached, Exception)):
+                continue
+        entry[3] = now + period
+        if entry[6][1]:
+            concurrent.append(_sample_plan(entry))
+        else:
+            await _sample_plan(entry)
 
-            except Exception as e:
-                hub_data["imu"] = {"error": str(e)}
+    if len(concurrent) == 1:
+        await concurrent[0]
+    elif concurrent:
+        await multitask(*concurrent)
 
-        # System information
-        if hasattr(_hub, "system"):
-            system = _hub.system
-            try:
-                hub_data["system"] = {
-                    "name": system.name(),
-                }
-            except:
-                pass
 
+async def _sample_plan(entry):
+    """Read one plan entry, caching its values or the exception raised."""
+    entry[5] = None
+    try:
+        entry[4] = await _read_plan(entry[6])
     except Exception as e:
-        hub_data["error"] = str(e)
+        entry[4] = e
+
+
+def _optional_method(device, name):
+    """Return a bound method if the device has it, else None."""
+    if hasattr(device, name):
+        return getattr(device, name)
+    return None
+
+
+def _probe_reader(method, width=1):
+    """Return method if one read works (vectors must index), else None."""
+    try:
+        value = method()
+        if width > 1:
+            value[width - 1]
+        return method
+    except Exception:
+        return None
+
+
+def _motor_plan(motor):
+    """Build a motor plan, probing once whether load() is supported."""
+    readers = ((motor.angle, 1), (motor.speed, 1), (_probe_reader(motor.load), 1))
+    return ("motor", False, readers, _shape_motor)
+
+
+def _motor_acceleration(motor):
+    """Return the motor's acceleration limit in deg/s², or None."""
+    control = getattr(motor, "control", None)
+    if control is None:
+        return None
+    return control.limits()[1]
+
+
+def _motor_load_reader(name):
+    """Return the load() reader probed for a motor's plan, or None."""
+    prefix = "motors." + str(name)
+    for entry in _plans:
+        if entry[0] == prefix:
+            return entry[1][2][2][0]
+    return None
+
+
+def _sensor_plan(sensor, color_mode="all"):
+    """Build a sensor plan from the sensor's kind and available methods."""
+    kind = _sensor_kind(sensor)
+    if kind == "color":
+        readers = _color_readers(sensor, color_mode)
+    elif kind == "ultrasonic":
+        readers = ((sensor.distance, 1),)
+    elif kind == "force":
+        readers = ((sensor.force, 1), (sensor.pressed, 1))
+    elif kind == "rotation":
+        readers = ((sensor.angle, 1), (_optional_method(sensor, "speed"), 1))
+    else:
 
-    # Add gyro sensor data if registered separately
-    if _gyro_sensor:
+        def describe():
+            return str(sensor)
+
+        return (kind, False, ((describe, 1),), _shape_generic)
+    return (kind, True, readers, _SENSOR_SHAPERS[kind])
+
+
+def _color_readers(sensor, mode):
+    """Build the color, reflection and ambient readers for a sampling mode."""
+
+    async def read_color():
+        return await sensor.color(True)
+
+    methods = [
+        read_color,
+        _optional_method(sensor, "reflection"),
+        _optional_method(sensor, "ambient"),
+    ]
+
+    if mode in ("color", "reflection", "ambient"):
+        keep = ("color", "reflection", "ambient").index(mode)
+        for i in range(3):
+            if i != keep:
+                methods[i] = None
+
+    if mode != "rotate":
+        return tuple((method, 1) for method in methods)
+
+    # Read one mode per call, reporting the last value read for the others
+    available = [i for i in range(3) if methods[i] is not None]
+    values = [None, None, None]
+    turn = [0]
+
+    async def read_rotating():
+        i = available[turn[0]]
+        turn[0] = (turn[0] + 1) % len(available)
+        values[i] = await methods[i]()
+        return values
+
+    return ((read_rotating, 3),)
+
+
+def _gyro_plan(gyro_sensor):
+    """Build a gyro plan, or None if the sensor cannot report an angle."""
+    if not hasattr(gyro_sensor, "angle"):
+        return None
+    readers = ((gyro_sensor.angle, 1), (_optional_method(gyro_sensor, "speed"), 1))
+    return ("gyro", False, readers, _shape_rotation_data)
+
+
+def _drivebase_plan(drivebase):
+    """Build a drivebase plan, including state() when available."""
+    state = _optional_method(drivebase, "state")
+    if state is None:
+        readers = ((drivebase.distance, 1), (drivebase.angle, 1))
+        return ("drivebase", False, readers, _shape_drivebase)
+    readers = ((drivebase.distance, 1), (drivebase.angle, 1), (state, 4))
+    return ("drivebase_state", False, readers, _shape_drivebase)
+
+
+def _register_hub_plans(hub):
+    """Build the battery, IMU and system plans for a hub."""
+    battery = None
+    if hasattr(hub, "battery"):
+        readers = ((hub.battery.voltage, 1), (hub.battery.current, 1))
+        battery = ("battery", False, readers, _shape_battery)
+    _set_plan("hub.battery", battery)
+
+    imu = None
+    if hasattr(hub, "imu"):
+        # Some firmware cannot convert the IMU vectors; probe each reader once
+        # so one failing field does not drop the others
+        readers = (
+            (_probe_reader(hub.imu.heading), 1),
+            (_probe_reader(hub.imu.acceleration, 3), 3),
+            (_probe_reader(hub.imu.angular_velocity, 3), 3),
+        )
+        imu = ("imu", False, readers, _shape_imu)
+    _set_plan("hub.imu", imu)
+
+    system = None
+    if hasattr(hub, "system"):
+        system = ("system", False, ((hub.system.name, 1),), _shape_system)
+    _set_plan("hub.system", system)
+
+
+async def _read_plan(plan):
+    """Run a plan's readers and return one value per field."""
+    kind, is_async, readers, shaper = plan
+    values = []
+    for method, width in readers:
+        if method is None:
+            value = None
+        elif is_async:
+            value = await method()
+        else:
+            value = method()
+        if width == 1:
+            values.append(value)
+        elif value is None:
+            values.extend([None] * width)
+        else:
+            for i in range(width):
+                values.append(value[i])
+    return values
+
+
+def _number(value):
+    """Return value as a float, or None if it is not numeric."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
+def _shape_motor(values):
+    data = {"angle": float(values[0]), "speed": float(values[1])}
+    if values[2] is not None:
+        data["load"] = float(values[2])
+    return data
+
+
+def _shape_color(values):
+    data = {"type": "color"}
+    if values[0] is not None:
+        data["color"] = str(values[0])
+    if _number(values[1]) is not None:
+        data["reflection"] = float(values[1])
+    if _number(values[2]) is not None:
+        data["ambient"] = float(values[2])
+    return data
+
+
+def _shape_ultrasonic(values):
+    distance = _number(values[0])
+    if distance is None:
+        return {
+            "type": "ultrasonic",
+            "error": f"Invalid distance value: {values[0]}",
+            "raw_value": str(values[0]),
+        }
+    return {"type": "ultrasonic", "distance": distance}
+
+
+def _shape_force(values):
+    return {"type": "force", "force": float(values[0]), "pressed": bool(values[1])}
+
+
+def _shape_rotation_data(values):
+    return {"angle": float(values[0]), "speed": _number(values[1])}
+
+
+def _shape_rotation(values):
+    data = _shape_rotation_data(values)
+    data["type"] = "rotation"
+    return data
+
+
+def _shape_generic(values):
+    return {"type": "generic", "value": values[0]}
+
+
+def _shape_battery(values):
+    return {"voltage": values[0], "current": values[1]}
+
+
+def _shape_imu(values):
+    data = {}
+    if values[0] is not None:
+        data["heading"] = float(values[0])
+    if values[1] is None:
+        data["acceleration_error"] = "Matrix conversion not supported"
+    else:
+        data["acceleration"] = values[1:4]
+    if values[4] is None:
+        data["angular_velocity_error"] = "Matrix conversion not supported"
+    else:
+        data["angular_velocity"] = values[4:7]
+    return data
+
+
+def _shape_system(values):
+    return {"name": values[0]}
+
+
+def _shape_drivebase(values):
+    data = {"distance": float(values[0]), "angle": float(values[1])}
+    if len(values) > 2:
+        data["state"] = {
+            "distance": float(values[2]),
+            "drive_speed": float(values[3]),
+            "angle": float(values[4]),
+            "turn_rate": float(values[5]),
+        }
+    return data
+
+
+_SENSOR_SHAPERS = {
+    "color": _shape_color,
+    "ultrasonic": _shape_ultrasonic,
+    "force": _shape_force,
+    "rotation": _shape_rotation,
+}
+
+
+# Positional telemetry rows
+#
+# The schema is the list of device plans that contribute fields (motors,
+# sensors, hub battery/IMU, gyro, drivebase), each a fixed run of fields. A
+# row is the values of every field in schema order, collected straight into
+# a list without building the nested JSON dict. Each field is a (path, struct code,
+# scale) triple:
+#
+# - "rows" prints [PILOT:TR] [schema id, timestamp, value, ...] as JSON, with
+#   values quantized to the field's resolution and null for missing values.
+# - "binary" packs the same row as a little-endian struct (uint8 schema id,
+#   uint32 timestamp, then the fields multiplied by their scale) and prints
+#   [PILOT:TB] followed by base64, or hex when ubinascii is unavailable.
+#   Missing values use a reserved sentinel: the minimum of signed codes, the
+#   maximum of unsigned codes, NaN for floats.
+#
+# Colors travel as an index into _COLOR_NAMES in both encodings.
+
+_COLOR_NAMES = (
+    "Color.NONE",
+    "Color.BLACK",
+    "Color.GRAY",
+    "Color.WHITE",
+    "Color.RED",
+    "Color.ORANGE",
+    "Color.BROWN",
+    "Color.YELLOW",
+    "Color.GREEN",
+    "Color.CYAN",
+    "Color.BLUE",
+    "Color.VIOLET",
+    "Color.MAGENTA",
+)
+
+# Struct code -> (min, max, sentinel) for integer fields
+_BINARY_RANGES = {
+    "B": (0, 0xFE, 0xFF),
+    "H": (0, 0xFFFE, 0xFFFF),
+    "h": (-0x7FFF, 0x7FFF, -0x8000),
+    "i": (-0x7FFFFFFF, 0x7FFFFFFF, -0x80000000),
+}
+
+# Group kind -> fields as (name, struct code, scale)
+_GROUP_FIELDS = {
+    "motor": (("angle", "i", 1), ("speed", "h", 1), ("load", "h", 1)),
+    "color": (("color", "B", 1), ("reflection", "B", 1), ("ambient", "B", 1)),
+    "ultrasonic": (("distance", "H", 1),),
+    "force": (("force", "h", 100), ("pressed", "B", 1)),
+    "rotation": (("angle", "i", 1), ("speed", "h", 1)),
+    "generic": (),
+    "system": (),
+    "battery": (("voltage", "H", 1), ("current", "H", 1)),
+    "imu": (
+        ("heading", "f", 1),
+        ("acceleration.0", "h", 1),
+        ("acceleration.1", "h", 1),
+        ("acceleration.2", "h", 1),
+        ("angular_velocity.0", "h", 10),
+        ("angular_velocity.1", "h", 10),
+        ("angular_velocity.2", "h", 10),
+    ),
+    "gyro": (("angle", "i", 1), ("speed", "h", 1)),
+    "drivebase": (("distance", "i", 1), ("angle", "f", 1)),
+    "drivebase_state": (
+        ("distance", "i", 1),
+        ("angle", "f", 1),
+        ("state.distance", "i", 1),
+        ("state.drive_speed", "h", 1),
+        ("state.angle", "f", 1),
+        ("state.turn_rate", "h", 1),
+    ),
+}
+
+
+def _build_telemetry_schema():
+    """Build the telemetry schema from the registered device plans."""
+    groups = []
+    fields = []
+    color_slots = []
+    for entry in _plans:
+        if entry[6] is None:
+            continue
+        prefix = entry[0]
+        kind = entry[1][0]
+        slots = []
+        group_fields = _GROUP_FIELDS[kind]
+        for i in range(len(group_fields)):
+            name, code, scale = group_fields[i]
+            path = prefix + "." + name
+            if not _is_subscribed(path):
+                continue
+            if name == "color":
+                color_slots.append(len(fields))
+            fields.append((path, code, scale))
+            slots.append(i)
+        if slots:
+            groups.append((prefix, kind, entry, slots))
+
+    codes = "".join(field[1] for field in fields)
+    sample_format = "<H" + codes
+    return {
+        "groups": groups,
+        "entries": [group[2] for group in groups],
+        "fields": fields,
+        "color_slots": color_slots,
+        "codes": codes,
+        "format": "<BI" + codes,
+        "sample_format": sample_format,
+        "sample_size": struct.calcsize(sample_format),
+        "epsilons": _field_epsilons(fields),
+    }
+
+
+def _get_telemetry_schema():
+    """Return the current schema, rebuilding and announcing it if needed."""
+    global _telemetry_schema, _telemetry_schema_id
+
+    if _telemetry_schema is None:
+        _telemetry_schema = _build_telemetry_schema()
+        _telemetry_schema_id = (_telemetry_schema_id + 1) & 0xFF
+        request_telemetry_keyframe()
+        _announce_telemetry_schema()
+    return _telemetry_schema
+
+
+def _announce_telemetry_schema():
+    """Print the schema so the browser can decode subsequent rows."""
+    schema = _telemetry_schema
+    announcement = {
+        "id": _telemetry_schema_id,
+        "devices": {group[0]: group[1] for group in schema["groups"]},
+        "fields": [list(field) for field in schema["fields"]],
+        "format": schema["format"],
+        "encoding": "base64" if b2a_base64 else "hex",
+        "colors": _COLOR_NAMES,
+        "subscription": _telemetry_subscription,
+    }
+    # The hub name never changes, so it travels with the schema, not each row
+    if _hub is not None and hasattr(_hub, "system"):
         try:
-            if hasattr(_gyro_sensor, "angle"):
-                hub_data["gyro"] = {
-                    "angle": float(_gyro_sensor.angle()),
-                    "speed": (
-                        float(_gyro_sensor.speed())
-                        if hasattr(_gyro_sensor, "speed")
-                        else None
-                    ),
-                }
-        except Exception as e:
-            hub_data["gyro"] = {"error": str(e)}
+            announcement["hub_name"] = _hub.system.name()
+        except Exception:
+            pass
+    print("[PILOT:TELEMETRY_SCHEMA]", json.dumps(announcement))
+
+
+def _color_index(color_value):
+    """Map a Color to its index in _COLOR_NAMES, or None if unknown."""
+    name = str(color_value)
+    if name in _COLOR_NAMES:
+        return _COLOR_NAMES.index(name)
+    return None
+
+
+async def _collect_telemetry_row(schema, timestamp):
+    """Sample due devices and return one value per schema field.
+
+    Devices that are not due contribute their cached values; failed reads
+    yield None values.
+    """
+    entries = schema["entries"]
+    await _sample_due_plans(entries, timestamp)
+
+    row = []
+    for prefix, kind, entry, slots in schema["groups"]:
+        values = entry[4]
+        if isinstance(values, Exception):
+            row.extend([None] * len(slots))
+        else:
+            for i in slots:
+                row.append(values[i])
+    for i in schema["color_slots"]:
+        row[i] = _color_index(row[i])
+    return row
+
+
+def _row_value(value, code, scale):
+    """Quantize a value to its field's resolution for a JSON row."""
+    if not isinstance(value, (int, float)):
+        return None
+    if code == "f":
+        return round(value, 2)
+    if scale == 1:
+        return int(round(value))
+    return round(value * scale) / scale
+
+
+def _binary_value(value, code, scale):
+    """Convert a value to the integer or float packed for its field."""
+    if code == "f":
+        if isinstance(value, (int, float)):
+            return float(value)
+        return float("nan")
+
+    low, high, sentinel = _BINARY_RANGES[code]
+    if not isinstance(value, (int, float)):
+        return sentinel
+    value = int(round(value * scale))
+    if value < low:
+        return low
+    if value > high:
+        return high
+    return value
+
+
+def _encode_frame(frame):
+    """Encode packed bytes as base64, or hex when ubinascii is unavailable."""
+    if b2a_base64:
+        return b2a_base64(frame).decode().strip()
+    return "".join("%02x" % b for b in frame)
+
+
+def _binary_values(values, fields, indices):
+    """Convert the given field indices of a quantized row for packing."""
+    packed = []
+    for i in indices:
+        field = fields[i]
+        packed.append(_binary_value(values[i], field[1], field[2]))
+    return packed
+
+
+def _pack_values(codes, values, fields, indices):
+    """Pack the given field indices of a quantized row as little-endian bytes."""
+    return struct.pack("<" + codes, *_binary_values(values, fields, indices))
+
+
+async def _send_row_telemetry(timestamp):
+    """Collect a positional row and print it in the selected compact format."""
+    schema = _get_telemetry_schema()
+    row = await _collect_telemetry_row(schema, timestamp)
+
+    fields = schema["fields"]
+    values = []
+    for i in range(len(row)):
+        field = fields[i]
+        values.append(_row_value(row[i], field[1], field[2]))
+
+    if _telemetry_delta:
+        _send_delta_telemetry(schema, timestamp, values)
+        return
+
+    if _telemetry_batch_size > 1:
+        _add_telemetry_sample(schema, timestamp, values)
+        return
+
+    if _telemetry_format == "binary":
+        frame = struct.pack("<BI", _telemetry_schema_id, timestamp & 0xFFFFFFFF)
+        frame += _pack_values(schema["codes"], values, fields, range(len(values)))
+        print("[PILOT:TB]", _encode_frame(frame))
+        return
+
+    print("[PILOT:TR]", json.dumps([_telemetry_schema_id, timestamp] + values))
+
+
+# Batched telemetry
+#
+# With a batch size K > 1 (and delta disabled) each tick's row is stored in a
+# buffer allocated once per schema, and every K samples one message carries
+# them all. Each sample starts with its uint16 offset in ms from the batch's
+# first timestamp. A batch is also flushed early when the schema changes or an
+# offset would overflow.
+#
+# - rows:   [PILOT:TRB] [schema id, first timestamp, [offset, value, ...], ...]
+# - binary: [PILOT:TBB] "<BIB" header (schema id, first timestamp, sample
+#           count) + count samples packed as "<H" + the schema's field codes
+
+
+def set_telemetry_batch(samples=1):
+    """Send telemetry in batches of this many samples (1 disables batching)."""
+    global _telemetry_batch_size, _telemetry_batch
+    _flush_telemetry_batch()
+    _telemetry_batch_size = max(1, min(255, int(samples)))
+    _telemetry_batch = None
+    print("[PILOT] Telemetry batch size set to", _telemetry_batch_size)
+
+
+def _add_telemetry_sample(schema, timestamp, values):
+    """Store one quantized row in the batch buffer, flushing when it is full."""
+    global _telemetry_batch, _telemetry_batch_count, _telemetry_batch_start
+
+    if _telemetry_batch_count and timestamp - _telemetry_batch_start > 0xFFFF:
+        _flush_telemetry_batch()
+    if _telemetry_batch is None:
+        if _telemetry_format == "binary":
+            size = 6 + _telemetry_batch_size * schema["sample_size"]
+            _telemetry_batch = bytearray(size)
+        else:
+            _telemetry_batch = [None] * _telemetry_batch_size
+    if _telemetry_batch_count == 0:
+        _telemetry_batch_start = timestamp
+
+    offset = timestamp - _telemetry_batch_start
+    if _telemetry_format == "binary":
+        packed = _binary_values(values, schema["fields"], range(len(values)))
+        position = 6 + _telemetry_batch_count * schema["sample_size"]
+        struct.pack_into(
+            schema["sample_format"], _telemetry_batch, position, offset, *packed
+        )
+    else:
+        _telemetry_batch[_telemetry_batch_count] = [offset] + values
+    _telemetry_batch_count += 1
+
+    if _telemetry_batch_count >= _telemetry_batch_size:
+        _flush_telemetry_batch()
+
+
+def _flush_telemetry_batch():
+    """Print the pending batched samples, if any."""
+    global _telemetry_batch_count
+
+    count = _telemetry_batch_count
+    if not count or _telemetry_batch is None or _telemetry_schema is None:
+        _telemetry_batch_count = 0
+        return
+    _telemetry_batch_count = 0
+
+    if isinstance(_telemetry_batch, bytearray):
+        struct.pack_into(
+            "<BIB",
+            _telemetry_batch,
+            0,
+            _telemetry_schema_id,
+            _telemetry_batch_start & 0xFFFFFFFF,
+            count,
+        )
+        size = 6 + count * _telemetry_schema["sample_size"]
+        print("[PILOT:TBB]", _encode_frame(memoryview(_telemetry_batch)[:size]))
+        return
+
+    frame = [_telemetry_schema_id, _telemetry_batch_start]
+    for i in range(count):
+        frame.append(_telemetry_batch[i])
+    print("[PILOT:TRB]", json.dumps(frame))
+
+
+# Delta telemetry
+#
+# With delta enabled every frame carries a uint16 sequence number that
+# increments per frame sent. A keyframe holds the full row; a delta frame
+# holds only the fields that moved more than their epsilon since they were
+# last sent, and ticks with no changes send nothing. A keyframe goes out every
+# _telemetry_keyframe_interval ticks, after a schema change, or when the
+# browser asks with {"action": "telemetry_keyframe"} after spotting a gap in
+# the sequence numbers.
+#
+# - rows:   [PILOT:TK] [schema id, seq, timestamp, value, ...]
+#           [PILOT:TD] [schema id, seq, timestamp, index, value, ...]
+# - binary: [PILOT:TBK] "<BHI" header (schema id, seq, timestamp) + all fields
+#           [PILOT:TBD] "<BHI" header + changed-field bitmask (one bit per
+#           field, LSB first) + the changed fields in schema order
+
+
+def set_telemetry_delta(enabled=True, keyframe_interval=None, epsilons=None):
+    """Enable delta telemetry for the rows and binary formats.
+
+    Args:
+        enabled: Send only changed fields between keyframes.
+        keyframe_interval: Ticks between full keyframes.
+        epsilons: Dict of field path (or device prefix such as "hub.battery")
+            to the minimum change worth sending.
+    """
+    global _telemetry_delta, _telemetry_keyframe_interval
+    _telemetry_delta = enabled
+    if keyframe_interval:
+        _telemetry_keyframe_interval = max(1, int(keyframe_interval))
+    if epsilons is not None:
+        _telemetry_epsilons.update(epsilons)
+        if _telemetry_schema is not None:
+            _telemetry_schema["epsilons"] = _field_epsilons(_telemetry_schema["fields"])
+    request_telemetry_keyframe()
+    print(
+        "[PILOT] Delta telemetry",
+        "enabled" if enabled else "disabled",
+        "- keyframe every",
+        _telemetry_keyframe_interval,
+        "ticks",
+    )
+
+
+def request_telemetry_keyframe():
+    """Send a full keyframe on the next delta tick."""
+    global _telemetry_last_sent
+    _telemetry_last_sent = None
+
+
+def _field_epsilons(fields):
+    """Resolve the per-field change threshold for delta frames."""
+    epsilons = []
+    for path, code, scale in fields:
+        epsilon = _telemetry_epsilons.get(path)
+        if epsilon is None:
+            epsilon = _telemetry_epsilons.get(path[: path.rfind(".")], 0)
+        epsilons.append(epsilon)
+    return epsilons
+
+
+def _send_delta_telemetry(schema, timestamp, values):
+    """Print a keyframe or the fields that changed since they were last sent."""
+    global _telemetry_last_sent, _telemetry_seq, _telemetry_ticks_since_keyframe
+
+    last = _telemetry_last_sent
+    _telemetry_ticks_since_keyframe += 1
+    keyframe = (
+        last is None or _telemetry_ticks_since_keyframe >= _telemetry_keyframe_interval
+    )
+
+    if keyframe:
+        _telemetry_last_sent = list(values)
+        _telemetry_ticks_since_keyframe = 0
+        changed = range(len(values))
+    else:
+        epsilons = schema["epsilons"]
+        changed = []
+        for i in range(len(values)):
+            value = values[i]
+            previous = last[i]
+            if value == previous:
+                continue
+            if value is None or previous is None or abs(value - previous) > epsilons[i]:
+                changed.append(i)
+                last[i] = value
+        if not changed:
+            return
+
+    seq = _telemetry_seq
+    _telemetry_seq = (seq + 1) & 0xFFFF
+
+    if _telemetry_format == "binary":
+        frame = struct.pack("<BHI", _telemetry_schema_id, seq, timestamp & 0xFFFFFFFF)
+        fields = schema["fields"]
+        if keyframe:
+            frame += _pack_values(schema["codes"], values, fields, changed)
+            print("[PILOT:TBK]", _encode_frame(frame))
+            return
+        mask = bytearray((len(values) + 7) >> 3)
+        codes = ""
+        for i in changed:
+            mask[i >> 3] |= 1 << (i & 7)
+            codes += fields[i][1]
+        frame += bytes(mask) + _pack_values(codes, values, fields, changed)
+        print("[PILOT:TBD]", _encode_frame(frame))
+        return
+
+    if keyframe:
+        print("[PILOT:TK]", json.dumps([_telemetry_schema_id, seq, timestamp] + values))
+        return
+    frame = [_telemetry_schema_id, seq, timestamp]
+    for i in changed:
+        frame.append(i)
+        frame.append(values[i])
+    print("[PILOT:TD]", json.dumps(frame))
+
+
+async def _collect_telemetry_json(timestamp):
+    """Sample due devices and shape every device's values into the JSON frame."""
+    telemetry = {
+        "timestamp": timestamp,
+        "type": "telemetry",
+    }
+
+    await _sample_due_plans(_plans, timestamp)
+
+    for entry in _plans:
+        if entry[6] is None:
+            continue
+        prefix = entry[0]
+        parts = prefix.split(".", 1)
+        data = entry[5]
+        if data is None:
+            values = entry[4]
+            if isinstance(values, Exception):
+                data = {"error": str(values)}
+                if parts[0] == "sensors":
+                    data["type"] = "error"
+            else:
+                try:
+                    data = entry[1][3](values)
+                except Exception as e:
+                    data = {"error": str(e)}
+            entry[5] = data
+
+        if len(parts) == 1:
+            telemetry[prefix] = data
+        else:
+            if parts[0] not in telemetry:
+                telemetry[parts[0]] = {}
+            telemetry[parts[0]][parts[1]] = data
 
-    return hub_data
+    return telemetry
 
 
 async def send_telemetry():
@@ -343,45 +1215,21 @@ async def send_telemetry():
         return
 
     _last_telemetry_time = current_time
+    await _send_telemetry_frame(current_time)
 
-    # Collect all telemetry data
-    telemetry = {
-        "timestamp": current_time,
-        "type": "telemetry",
-    }
-
-    # Add motor data
-    motor_data = _get_motor_telemetry()
-    if motor_data:
-        telemetry["motors"] = motor_data
 
-    # Add sensor data
-    sensor_data = await _get_sensor_telemetry()
-    if sensor_data:
-        telemetry["sensors"] = sensor_data
-
-    # Add hub data
-    hub_data = _get_hub_telemetry()
-    if hub_data:
-        telemetry["hub"] = hub_data
+async def _send_telemetry_frame(current_time):
+    """Collect and print one telemetry frame in the selected format."""
+    try:
+        if _telemetry_format != "json":
+            await _send_row_telemetry(current_time)
+            return
+    except Exception as e:
+        print("[PILOT] Telemetry error:", e)
+        return
 
-    # Add drivebase data if available
-    if _drivebase:
-        try:
-            telemetry["drivebase"] = {
-                "distance": float(_drivebase.distance()),
-                "angle": float(_drivebase.angle()),
-            }
-            if hasattr(_drivebase, "state"):
-                state = _drivebase.state()
-                telemetry["drivebase"]["state"] = {
-                    "distance": float(state[0]),
-                    "drive_speed": float(state[1]),
-                    "angle": float(state[2]),
-                    "turn_rate": float(state[3]),
-                }
-        except Exception as e:
-            telemetry["drivebase"] = {"error": str(e)}
+    # Collect all telemetry data
+    telemetry = await _collect_telemetry_json(current_time)
 
     # Send telemetry as JSON to stdout
     try:
@@ -394,594 +1242,2755 @@ async def _execute_command_sequence(commands):
     """Execute a sequence of commands with appropriate stop behavior.
 
     All commands except the last use Stop.COAST_SMART for smooth transitions.
-    The last command uses Stop.HOLD for precise final positioning.
+    The last command uses Stop.HOLD for precise final positioning. Returns
+    True when every command completed.
     """
     try:
-        print(f"[PILOT] Executing command sequence of {len(commands)} commands")
+        count = len(commands)
+        print(f"[PILOT] Executing command sequence of {count} commands")
 
         for i, cmd in enumerate(commands):
-            is_last_command = i == len(commands) - 1
-
-            # Add stop behavior to command based on position in sequence
-            if "action" in cmd and cmd["action"] in ["drive", "turn", "arc"]:
-                # Clone the command to avoid modifying the original
-                cmd_with_stop = cmd.copy()
-                if is_last_command:
-                    cmd_with_stop["stop_behavior"] = "hold"
-                    print(
-                        f"[PILOT] Executing final command {i+1}/{len(commands)} with HOLD"
-                    )
-                else:
-                    cmd_with_stop["stop_behavior"] = "coast_smart"
-                    print(
-                        f"[PILOT] Executing command {i+1}/{len(commands)} with COAST_SMART"
-                    )
+            completed = await _execute_sequence_step(cmd, i == count - 1, i + 1)
+            if not completed or _command_cancel:
+                return _sequence_aborted()
+        print("[PILOT] Command sequence completed")
+        return True
 
-                # Execute the individual command with stop behavior
-                completed = await _execute_single_command(cmd_with_stop)
-                if not completed:
-                    print("[PILOT] Command sequence aborted")
-                    break
-            else:
-                # For non-movement commands, execute normally
-                print(f"[PILOT] Executing non-movement command {i+1}/{len(commands)}")
-                completed = await _execute_single_command(cmd)
-                if not completed:
-                    print("[PILOT] Command sequence aborted")
-                    break
+    except Exception as e:
+        print("[PILOT] Command sequence error:", e)
+    return False
+
+
+def _sequence_aborted():
+    """Report a sequence that ended early; returns False for the caller.
+
+    A stop that lands while a step is running ends that step's motion
+    normally, so the cancel flag is checked after each step as well.
+    """
+    if _command_cancel:
+        print("[PILOT] Command sequence cancelled")
+    else:
+        print("[PILOT] Command sequence aborted")
+    return False
+
+
+async def _execute_sequence_step(cmd, is_last, number):
+    """Run one sequence command; motion ends in HOLD only when it is last."""
+    if _command_cancel:
+        # A stop already ended the previous motion; do not start this one
+        return False
+    # Add stop behavior to command based on position in sequence
+    if cmd.get("action") in _SEQUENCE_MOTION_ACTIONS:
+        # Clone the command to avoid modifying the original
+        cmd = cmd.copy()
+        cmd["stop_behavior"] = "hold" if is_last else "coast_smart"
+    if _command_debug:
+        print("[PILOT] Executing sequence command", number, ":", cmd.get("action"))
+    return await _execute_single_command(cmd)
+
+
+# Parallel groups
+#
+# A "parallel" step runs its member commands at the same time, e.g. a drive
+# while an attachment motor moves. Each device may appear in one member only.
+# In "all" mode the group completes when every member has; a member that
+# fails (a stall, for example) stops the other members and fails the group
+# unless it is marked "optional". In "race" mode the first member to finish
+# ends the group and the others are stopped where they are. Members keep
+# their own "stall_ms"; drivebase members without a stop_behavior take the
+# group's, which a sequence sets from the group's position.
+
+# Actions whose member runs on the drivebase
+_PARALLEL_DRIVEBASE_ACTIONS = ("drive", "turn", "arc", "turn_and_drive")
+
+
+def _parallel_device(cmd):
+    """Return the device a group member drives, or None if it has none."""
+    action = cmd.get("action")
+    if action in _PARALLEL_DRIVEBASE_ACTIONS:
+        return _drivebase
+    if action == "motor":
+        return _motors.get(cmd.get("motor") or cmd.get("port"))
+    return None
+
+
+def _stop_parallel_members(members, keep):
+    """Stop the devices of every member except keep."""
+    for member in members:
+        if member is not keep and member[1] is not None:
+            try:
+                member[1].stop()
+            except Exception:
+                pass
+
+
+async def _run_parallel_member(member, members):
+    """Run one group member; a required member's failure stops the others."""
+    completed = await _execute_single_command(member[0])
+    if not completed and not member[0].get("optional"):
+        _stop_parallel_members(members, member)
+        member[2] = False
+    return completed
+
+
+async def _execute_parallel_group(commands, race=False, stop_behavior=None):
+    """Run commands concurrently; True if the group completed.
+
+    Returns False, without starting anything, if two members share a device.
+    """
+    members = []  # [command, device, completed]
+    devices = []
+    for cmd in commands:
+        device = _parallel_device(cmd)
+        if device is not None:
+            if device in devices:
+                print("[PILOT] Parallel members share a device:", cmd.get("action"))
+                return False
+            devices.append(device)
+        if (
+            stop_behavior is not None
+            and cmd.get("action") in _SEQUENCE_MOTION_ACTIONS
+            and "stop_behavior" not in cmd
+        ):
+            cmd = cmd.copy()
+            cmd["stop_behavior"] = stop_behavior
+        members.append([cmd, device, True])
+    if not members:
+        return True
+
+    results = await multitask(
+        *[_run_parallel_member(member, members) for member in members], race=race
+    )
+    if race:
+        # Only the winner has a result; stop the members still moving
+        for member, result in zip(members, results):
+            if result is not None:
+                _stop_parallel_members(members, member)
+                return result or bool(member[0].get("optional"))
+        return False
+    for member in members:
+        if not member[2]:
+            print("[PILOT] Parallel group aborted:", member[0].get("action"), "failed")
+            return False
+    return True
+
+
+# Blended motion
+#
+# A sequence sent with "blend": true drives each run of consecutive drive,
+# turn and arc commands as one velocity profile. The hub updates
+# DriveBase.drive() every BLEND_CONTROL_INTERVAL_MS. Speed carries across
+# segment boundaries, so the robot slows down only before the end of the run,
+# before an in-place turn or a change of direction, and where the next
+# segment is slower. A segment is [rotational, length, speed, turn per mm,
+# stall_ms or None, acceleration]; speed and acceleration come from the
+# command's profile where it sets them, else from the drivebase settings.
+# Drive and arc lengths are in mm, measured with distance().
+# Turn lengths are in degrees, measured with angle(). Targets accumulate
+# from the start of the run, so the overshoot of one segment counts toward
+# the next; arcs also advance the heading target. Other commands, and arcs
+# given by startAngle/endAngle, run normally between blended runs. Each
+# segment registers a stall watch like a single motion, and its commanded
+# speed follows the profile so planned slowdowns do not count as stalls.
+
+BLEND_CONTROL_INTERVAL_MS = 20
+BLEND_MIN_SPEED = 20  # mm/s or deg/s kept until a segment's end is reached
+BLEND_DEFAULT_ACCELERATION = 500  # mm/s² or deg/s² when the hub cannot tell
+
+
+def _blend_segment(cmd):
+    """Return the blended segment for a command, or None if it runs normally."""
+    action = cmd.get("action")
+    if action not in ("drive", "turn", "arc"):
+        return None
+    speed = cmd.get("speed")
+    acceleration = None
+    setting = 2 if action == "turn" else 0
+    if "profile" in cmd:
+        index = _motion_profile_index(cmd["profile"])
+        if index is None:
+            return None
+        settings = _motion_profiles[index][1]
+        if not speed:
+            speed = settings[setting]
+        acceleration = settings[setting + 1]
+    if not speed:
+        speed = _drivebase_setting(setting) or 100
+    if not acceleration:
+        acceleration = _drivebase_setting(setting + 1) or BLEND_DEFAULT_ACCELERATION
+    stall_ms = cmd.get("stall_ms")
+    if action == "drive":
+        distance = cmd.get("distance", 0)
+        return [False, distance, abs(speed), 0, stall_ms, acceleration]
+    if action == "turn":
+        return [True, cmd.get("angle", 0), abs(speed), 0, stall_ms, acceleration]
+    radius = cmd.get("radius", 100)
+    angle = cmd.get("angle")
+    if angle is None or not radius:
+        return None
+    # Positive radius curves clockwise; negative angle drives backward
+    length = abs(radius) * angle * pi / 180
+    return [False, length, abs(speed), 180 / (pi * radius), stall_ms, acceleration]
+
+
+def _blend_exit_speeds(segments):
+    """Return the highest speed at which each drive or arc segment may end.
+
+    The slowdown into a segment happens on that segment, at its acceleration.
+    """
+    count = len(segments)
+    exits = [0] * count
+    for i in range(count - 2, -1, -1):
+        current = segments[i]
+        following = segments[i + 1]
+        if current[0] or following[0] or (current[1] < 0) != (following[1] < 0):
+            continue  # Stop for in-place turns and changes of direction
+        reachable = sqrt(exits[i + 1] ** 2 + 2 * following[5] * abs(following[1]))
+        exits[i] = min(current[2], following[2], reachable)
+    return exits
+
+
+async def _blend_segment_motion(segment, target, exit_speed, carried, watch):
+    """Drive one segment up to target; carried holds the speed across segments."""
+    rotational, length, limit, turn_per_mm = segment[:4]
+    acceleration = segment[5]
+    direction = -1 if length < 0 else 1
+    read = _drivebase.angle if rotational else _drivebase.distance
+    speed = 0 if rotational else carried[0]
+    last = get_time_ms()
+    while not _command_cancel and (watch is None or watch["reason"] is None):
+        remaining = (target - read()) * direction
+        if remaining <= 0:
+            break
+        now = get_time_ms()
+        speed = min(
+            limit,
+            speed + acceleration * (now - last) / 1000,
+            sqrt(exit_speed**2 + 2 * acceleration * remaining),
+        )
+        speed = max(speed, BLEND_MIN_SPEED)
+        last = now
+        if watch is not None:
+            # Slowing down on purpose is not a stall
+            watch["commanded"] = speed
+        if rotational:
+            _drivebase.drive(0, direction * speed)
         else:
-            print("[PILOT] Command sequence completed")
+            _drivebase.drive(direction * speed, direction * speed * turn_per_mm)
+        await wait(BLEND_CONTROL_INTERVAL_MS)
+    carried[0] = 0 if rotational else speed
+
+
+async def _run_blended_segments(segments, hold):
+    """Drive segments as one profile; True if the run completed."""
+    exits = _blend_exit_speeds(segments)
+    targets = [_drivebase.distance(), _drivebase.angle()]
+    started = get_time_ms()
+    carried = [0]
+    completed = False
+    try:
+        for i, segment in enumerate(segments):
+            rotational, length, limit, turn_per_mm, stall_ms, acceleration = segment
+            targets[rotational] += length
+            if turn_per_mm:
+                targets[1] += length * turn_per_mm  # Heading an arc turns
+            if rotational:
+                progress = _drivebase.angle
+                tolerance = STALL_ROTATION_TOLERANCE_DEG
+            else:
+                progress = _drivebase.distance
+                tolerance = STALL_PROGRESS_TOLERANCE_MM
+            watch = _new_stall_watch(
+                _drivebase,
+                "drivebase",
+                stall_ms,
+                progress,
+                _drivebase_speed(3 if rotational else 1),
+                None,
+                limit,
+                tolerance,
+                acceleration,
+            )
+            motion = _blend_segment_motion(
+                segment, targets[rotational], exits[i], carried, watch
+            )
+            stalled = await _run_with_stall(watch, motion)
+            if stalled:
+                _emit_browser_alert(
+                    "DRIVE_STALL",
+                    "Blended movement "
+                    + _stall_detail(stalled, "drivebase", stall_ms)
+                    + ". Command aborted.",
+                )
+                return False
+            if _command_cancel:
+                return False
+        completed = True
+    finally:
+        if not completed:
+            _drivebase.stop()
+    if hold:
+        await _drivebase.straight(0, then=Stop.HOLD)
+    else:
+        _drivebase.stop()
+    if _command_debug:
+        print(
+            "[PILOT] Blended",
+            len(segments),
+            "segments in",
+            get_time_ms() - started,
+            "ms",
+        )
+    return True
+
+
+async def _execute_blended_sequence(commands):
+    """Run a sequence, blending each run of drive, turn and arc commands."""
+    if _requires_drivebase("sequence"):
+        return False
+    count = len(commands)
+    print(f"[PILOT] Executing blended command sequence of {count} commands")
+    try:
+        segments = []
+        for i, cmd in enumerate(commands):
+            segment = _blend_segment(cmd)
+            if segment is not None:
+                segments.append(segment)
+                if i < count - 1:
+                    continue
+                completed = await _run_blended_segments(segments, True)
+            else:
+                completed = True
+                if segments:
+                    completed = await _run_blended_segments(segments, False)
+                if completed:
+                    completed = await _execute_sequence_step(
+                        cmd, i == count - 1, i + 1
+                    )
+            segments = []
+            if not completed or _command_cancel:
+                return _sequence_aborted()
+        print("[PILOT] Command sequence completed")
+        return True
 
     except Exception as e:
         print("[PILOT] Command sequence error:", e)
+    return False
 
 
-async def _execute_command(command):
-    """Execute a received command or command sequence."""
-    if command is None:
-        return
+# Path following
+#
+# follow_path drives through waypoints with a pure-pursuit tracker. Points
+# are in mm relative to the pose at the start, with x ahead and y to the
+# left. They are packed as int16 pairs in a bytearray, 4 bytes per point.
+# Every PATH_CONTROL_INTERVAL_MS the tracker advances the pose from the
+# distance() change and the heading, which comes from the hub IMU when the
+# registered hub has a working one and from the drivebase angle otherwise
+# (chosen once when the path starts). It then steers with
+# drive(speed, turn_rate) toward the point where a circle of the lookahead
+# radius crosses the path. Speed ramps with the straight acceleration setting
+# and is capped so the turn rate stays within the turn rate setting. It slows
+# down over the path length left and stops at the last point, or once the
+# robot has passed it. Paths are driven forward only. The run registers a
+# stall watch whose commanded speed follows the tracker.
+
+PATH_CONTROL_INTERVAL_MS = 20
+PATH_LOOKAHEAD_MM = 80
+PATH_END_TOLERANCE_MM = 10
+_PATH_POINT = "<hh"
+
+
+def pack_path(points):
+    """Pack [[x, y], ...] or a flat [x0, y0, x1, y1, ...] list of mm."""
+    if points and not isinstance(points[0], (list, tuple)):
+        points = [points[i : i + 2] for i in range(0, len(points) - 1, 2)]
+    path = bytearray(4 * len(points))
+    for i, point in enumerate(points):
+        struct.pack_into(
+            _PATH_POINT, path, 4 * i, int(round(point[0])), int(round(point[1]))
+        )
+    return path
 
-    try:
-        # Check if this is a command sequence (array of commands)
-        if isinstance(command, list):
-            await _execute_command_sequence(command)
-            return
 
-        # Single command - execute directly
-        await _execute_single_command(command)
+def _path_point(path, index):
+    return struct.unpack_from(_PATH_POINT, path, 4 * index)
+
+
+def _path_heading_reader():
+    """Return the heading reader for a path, in degrees clockwise positive.
+
+    The hub IMU is used when it reads; hubs without one fall back to the
+    drivebase angle. Chosen once per path, so the source never switches.
+    """
+    if _hub is not None and hasattr(_hub, "imu"):
+        reader = _probe_reader(_hub.imu.heading)
+        if reader is not None:
+            return reader
+    return _drivebase.angle
+
+
+def _path_lookahead(path, index, x, y, lookahead):
+    """Return (index, target x, target y) for the lookahead circle at x, y.
+
+    index is the first point not yet reached; it never moves backward.
+    """
+    last = len(path) // 4 - 1
+    while index < last:
+        px, py = _path_point(path, index)
+        if (px - x) ** 2 + (py - y) ** 2 > lookahead**2:
+            break
+        index += 1
+    ex, ey = _path_point(path, index)
+    if index == 0:
+        return index, ex, ey
+    sx, sy = _path_point(path, index - 1)
+    # Furthest crossing of the circle with the segment from sx, sy to ex, ey
+    dx = ex - sx
+    dy = ey - sy
+    fx = sx - x
+    fy = sy - y
+    a = dx * dx + dy * dy
+    b = 2 * (fx * dx + fy * dy)
+    c = fx * fx + fy * fy - lookahead**2
+    discriminant = b * b - 4 * a * c
+    if a == 0 or discriminant < 0:
+        return index, ex, ey
+    t = (-b + sqrt(discriminant)) / (2 * a)
+    if t >= 1 or t < 0:
+        return index, ex, ey
+    return index, sx + t * dx, sy + t * dy
+
+
+async def follow_path(path, speed=None, lookahead=None, stall_ms=None):
+    """Follow a packed or listed path with pure pursuit; True if it arrived."""
+    if _requires_drivebase("follow_path"):
+        return False
+    if not isinstance(path, (bytes, bytearray)):
+        path = pack_path(path)
+    count = len(path) // 4
+    if count == 0:
+        return True
+    speed = abs(speed or _drivebase_setting(0) or 100)
+    lookahead = lookahead or PATH_LOOKAHEAD_MM
+    acceleration = _drivebase_setting(1) or BLEND_DEFAULT_ACCELERATION
+    max_turn_rate = _drivebase_setting(2) or 360
+    heading = _path_heading_reader()
+    watch = _new_stall_watch(
+        _drivebase,
+        "drivebase",
+        stall_ms,
+        _drivebase.distance,
+        _drivebase_speed(1),
+        None,
+        speed,
+        STALL_PROGRESS_TOLERANCE_MM,
+        acceleration,
+    )
+    arrival = []  # End error in mm once the tracker arrives
+
+    async def track():
+        # Path length after each point is summed as the tracker passes it
+        remaining_path = 0
+        previous = _path_point(path, 0)
+        for i in range(1, count):
+            point = _path_point(path, i)
+            remaining_path += sqrt(
+                (point[0] - previous[0]) ** 2 + (point[1] - previous[1]) ** 2
+            )
+            previous = point
+
+        x = y = 0.0
+        heading_start = heading()
+        distance = _drivebase.distance()
+        index = 0
+        current = 0
+        last = get_time_ms()
+        while not _command_cancel and (watch is None or watch["reason"] is None):
+            travelled = _drivebase.distance()
+            theta = (heading_start - heading()) * pi / 180
+            x += (travelled - distance) * cos(theta)
+            y += (travelled - distance) * sin(theta)
+            distance = travelled
+
+            previous_index = index
+            index, tx, ty = _path_lookahead(path, index, x, y, lookahead)
+            while previous_index < index:
+                # Drop the length of the segments passed
+                a = _path_point(path, previous_index)
+                b = _path_point(path, previous_index + 1)
+                remaining_path -= sqrt((b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2)
+                previous_index += 1
+            ex, ey = _path_point(path, index)
+            to_point = sqrt((ex - x) ** 2 + (ey - y) ** 2)
+            if index == count - 1:
+                if to_point <= PATH_END_TOLERANCE_MM:
+                    arrival.append(to_point)
+                    return
+                if count > 1:
+                    # Passed the end when ahead of it along the last segment
+                    sx, sy = _path_point(path, index - 1)
+                    if (x - ex) * (ex - sx) + (y - ey) * (ey - sy) > 0:
+                        arrival.append(to_point)
+                        return
+
+            # Target in the robot frame: ahead along lx, left along ly
+            dx = tx - x
+            dy = ty - y
+            lx = dx * cos(theta) + dy * sin(theta)
+            ly = dy * cos(theta) - dx * sin(theta)
+            span = lx * lx + ly * ly
+            curvature = 2 * ly / span if span else 0
+            limit = speed
+            if curvature:
+                limit = min(limit, max_turn_rate * pi / 180 / abs(curvature))
+            now = get_time_ms()
+            current = min(
+                limit,
+                current + acceleration * (now - last) / 1000,
+                sqrt(2 * acceleration * (remaining_path + to_point)),
+            )
+            current = max(current, BLEND_MIN_SPEED)
+            if lx < 0 and index == count - 1:
+                current = BLEND_MIN_SPEED  # Turning back toward the end point
+            last = now
+            if watch is not None:
+                # Slowing down on purpose is not a stall
+                watch["commanded"] = current
+            turn_rate = -current * curvature * 180 / pi
+            turn_rate = max(-max_turn_rate, min(max_turn_rate, turn_rate))
+            _drivebase.drive(current, turn_rate)
+            await wait(PATH_CONTROL_INTERVAL_MS)
+
+    started = get_time_ms()
+    try:
+        stalled = await _run_with_stall(watch, track())
+    finally:
+        if not arrival:
+            _drivebase.stop()
+    if stalled:
+        _emit_browser_alert(
+            "DRIVE_STALL",
+            "Path following "
+            + _stall_detail(stalled, "drivebase", stall_ms)
+            + ". Command aborted.",
+        )
+        return False
+    if not arrival:
+        return False
+    await _drivebase.straight(0, then=Stop.HOLD)
+    print(
+        "[PILOT] Followed path of",
+        count,
+        "points in",
+        get_time_ms() - started,
+        "ms, end error",
+        round(arrival[0]),
+        "mm",
+    )
+    return True
+
+
+async def _execute_command(command):
+    """Execute a received command or command sequence; True if it completed."""
+    if command is None:
+        return False
+
+    try:
+        # Check if this is a command sequence (array of commands)
+        if isinstance(command, list):
+            return await _execute_command_sequence(command)
+
+        if isinstance(command, bytes):
+            return await _execute_binary_command(command)
+
+        # Single command - execute directly
+        return await _execute_single_command(command)
+
+    except Exception as e:
+        print("[PILOT] Command execution error:", e)
+    return False
+
+
+# Stall monitoring
+#
+# stall_monitor_task is one long-lived loop that checks every active motion
+# each STALL_FAST_CHECK_INTERVAL_MS. A motion registers a watch for as long as
+# it runs. When the watch fires, the monitor records the reason and stops the
+# device, which ends the pending Pybricks awaitable. A watch fires when:
+#   "stalled"   stalled() has held for the watch's duration. The duration
+#               comes from the command ("stall_ms", 0 disables all checks),
+#               then the device (set_stall_threshold), then STALL_DURATION_MS.
+#   "progress"  after the grace period the device runs below
+#               _stall_speed_ratio of its commanded speed and has not moved
+#               past the progress threshold for _stall_early_ms. The grace
+#               period is STALL_GRACE_MS, or the time the acceleration
+#               setting needs to reach that slow speed if longer. The
+#               threshold is STALL_PROGRESS_TOLERANCE_MM (or
+#               STALL_ROTATION_TOLERANCE_DEG), capped at half the distance
+#               the commanded speed covers in that window and at half of
+#               what the profile covers there while ramping.
+#   "load"      as "progress", but with a motor load at or above
+#               _stall_load_mnm it fires after half the window.
+# Each stall prints [PILOT:STALL] with the reason, the time from onset to
+# detection and the time into the motion. set_stall_sensitivity tunes the
+# early checks. Without the monitor task running, motions fall back to an
+# inline race that only checks stalled().
+
+STALL_FAST_CHECK_INTERVAL_MS = 20
+STALL_GRACE_MS = 150  # Shortest start time ignored by the early checks
+
+_stall_watches = []  # Active watches, checked by stall_monitor_task
+_stall_thresholds = {}  # "drivebase" or motor name -> stall duration in ms
+_stall_monitor_active = False
+_stall_early_ms = 250  # Window for the early checks; 0 disables them
+_stall_speed_ratio = 0.2  # Below this share of commanded speed counts as slow
+_stall_load_mnm = 100  # Motor load that counts as pushing against something
+
+
+def set_stall_threshold(device, duration_ms):
+    """Set the stall duration for "drivebase" or a motor name; None resets it."""
+    if duration_ms is None:
+        _stall_thresholds.pop(device, None)
+    else:
+        _stall_thresholds[device] = duration_ms
+    print("[PILOT] Stall threshold for", device, "set to", duration_ms, "ms")
+
+
+def set_stall_sensitivity(early_ms=None, speed_ratio=None, load_mnm=None):
+    """Tune early stall detection; early_ms=0 leaves only stalled() checks."""
+    global _stall_early_ms, _stall_speed_ratio, _stall_load_mnm
+    if early_ms is not None:
+        _stall_early_ms = early_ms
+    if speed_ratio is not None:
+        _stall_speed_ratio = speed_ratio
+    if load_mnm is not None:
+        _stall_load_mnm = load_mnm
+    print(
+        "[PILOT] Stall sensitivity: early",
+        _stall_early_ms,
+        "ms, speed ratio",
+        _stall_speed_ratio,
+        ", load",
+        _stall_load_mnm,
+        "mNm",
+    )
+
+
+def _stall_duration(device_name, stall_ms):
+    """Resolve the stall duration for a motion on a device."""
+    if stall_ms is not None:
+        return stall_ms
+    return _stall_thresholds.get(device_name, STALL_DURATION_MS)
+
+
+def _stall_detail(reason, device_name, stall_ms):
+    """Describe why a motion was stopped for a browser alert."""
+    if reason == "progress":
+        return "stopped making progress"
+    if reason == "load":
+        return "was blocked under load"
+    return f"stalled for over {_stall_duration(device_name, stall_ms)} ms"
+
+
+def _new_stall_watch(
+    device, name, stall_ms, progress, speed, load, commanded, tolerance, acceleration
+):
+    """Build a watch for a motion, or None when stall checks are disabled.
+
+    progress, speed and load are readers (speed and load may be None);
+    commanded and acceleration describe the motion's profile, if known.
+    """
+    duration = _stall_duration(name, stall_ms)
+    if duration <= 0:
+        return None
+    grace = STALL_GRACE_MS
+    if commanded:
+        tolerance = min(tolerance, abs(commanded) * _stall_early_ms / 2000)
+    if acceleration:
+        # A profile moves slowest over an early window at the ends of its
+        # ramps; allow half of that, and skip the ramp up to the slow speed
+        window = _stall_early_ms / 1000
+        tolerance = min(tolerance, acceleration * window * window / 4)
+        if commanded:
+            ramp = 1000 * _stall_speed_ratio * abs(commanded) / acceleration
+            grace = max(grace, ramp)
+    now = get_time_ms()
+    return {
+        "device": device,
+        "name": name,
+        "duration": duration,
+        "progress": progress,
+        "speed": speed,
+        "load": load,
+        "commanded": commanded,
+        "tolerance": tolerance,
+        "grace": grace,
+        "started": now,
+        "stall_start": None,
+        "mark_value": progress(),
+        "mark_time": now,
+        "reason": None,
+    }
+
+
+def _check_stall_watch(watch, now):
+    """Return (reason, onset time) if the watched motion stalled, else None."""
+    device = watch["device"]
+    if device.stalled():
+        if watch["stall_start"] is None:
+            watch["stall_start"] = now
+        elif now - watch["stall_start"] >= watch["duration"]:
+            return ("stalled", watch["stall_start"])
+    else:
+        watch["stall_start"] = None
+
+    if not _stall_early_ms:
+        return None
+    value = watch["progress"]()
+    if now - watch["started"] < watch["grace"]:
+        # Early windows start once the motion is past its ramp up
+        watch["mark_value"] = value
+        watch["mark_time"] = now
+        return None
+    if abs(value - watch["mark_value"]) > watch["tolerance"]:
+        watch["mark_value"] = value
+        watch["mark_time"] = now
+        return None
+
+    commanded = watch["commanded"]
+    if commanded and watch["speed"] is not None:
+        if abs(watch["speed"]()) >= _stall_speed_ratio * abs(commanded):
+            return None
+
+    stuck = now - watch["mark_time"]
+    if stuck >= _stall_early_ms:
+        return ("progress", watch["mark_time"])
+    if stuck >= _stall_early_ms // 2 and watch["load"] is not None:
+        if abs(watch["load"]()) >= _stall_load_mnm:
+            return ("load", watch["mark_time"])
+    return None
+
+
+async def stall_monitor_task():
+    """Async task that watches all registered motions for stalls."""
+    global _stall_monitor_active
+
+    _stall_monitor_active = True
+    try:
+        while True:
+            await wait(STALL_FAST_CHECK_INTERVAL_MS)
+            if not _stall_watches:
+                continue
+            now = get_time_ms()
+            for watch in _stall_watches:
+                if watch["reason"] is not None:
+                    continue
+                try:
+                    stall = _check_stall_watch(watch, now)
+                except Exception as e:
+                    print("[PILOT] Stall check error:", e)
+                    continue
+                if stall is None:
+                    continue
+                watch["reason"] = stall[0]
+                try:
+                    watch["device"].stop()
+                except Exception:
+                    pass
+                print(
+                    "[PILOT:STALL]",
+                    json.dumps(
+                        {
+                            "device": watch["name"],
+                            "reason": stall[0],
+                            "detect_ms": now - stall[1],
+                            "elapsed_ms": now - watch["started"],
+                        }
+                    ),
+                )
+    finally:
+        _stall_monitor_active = False
+
+
+async def _run_with_stall(watch, motion):
+    """Await a Pybricks motion; return the stall reason if one aborted it."""
+    if watch is None:
+        await motion
+        return None
+    if not _stall_monitor_active:
+        if await _run_with_inline_stall(watch["device"], motion, watch["duration"]):
+            return "stalled"
+        return None
+
+    _stall_watches.append(watch)
+    try:
+        await motion
+    finally:
+        _stall_watches.remove(watch)
+    return watch["reason"]
+
+
+async def _run_with_inline_stall(device, motion, duration):
+    """Race a motion against its own stall poller (no monitor task running)."""
+
+    async def motion_task():
+        await motion
+
+    async def monitor_task():
+        stall_start = None
+        try:
+            while True:
+                await wait(STALL_CHECK_INTERVAL_MS)
+                if device.stalled():
+                    if stall_start is None:
+                        stall_start = get_time_ms()
+                    elif get_time_ms() - stall_start >= duration:
+                        raise StallDetected()
+                else:
+                    stall_start = None
+        except StallDetected:
+            raise
+        except BaseException:
+            return
+
+    try:
+        await multitask(motion_task(), monitor_task(), race=True)
+        return False
+    except StallDetected:
+        try:
+            device.stop()
+        except Exception:
+            pass
+        return True
+
+
+def _drivebase_speed(index):
+    """Return a reader for one drivebase state() value, or None without state()."""
+    state = _optional_method(_drivebase, "state")
+    if state is None:
+        return None
+    return lambda: state()[index]
+
+
+async def _run_drive_with_stall(distance, stop_param, stall_ms=None):
+    """Run straight movement and abort if the drivebase remains stalled."""
+    if _drivebase is None:
+        return None
+
+    motion = _drivebase.straight(distance, then=stop_param, wait=True)
+    if abs(distance) <= STALL_PROGRESS_TOLERANCE_MM:
+        await motion
+        return None
+    watch = _new_stall_watch(
+        _drivebase,
+        "drivebase",
+        stall_ms,
+        _drivebase.distance,
+        _drivebase_speed(1),
+        None,
+        _drivebase_setting(0),
+        STALL_PROGRESS_TOLERANCE_MM,
+        _drivebase_setting(1),
+    )
+    return await _run_with_stall(watch, motion)
+
+
+async def _run_turn_with_stall(angle, stop_param, stall_ms=None):
+    """Run a turn and abort if the drivebase stalls."""
+    if _drivebase is None:
+        return None
+
+    motion = _drivebase.turn(angle, then=stop_param, wait=True)
+    if abs(angle) <= STALL_ROTATION_TOLERANCE_DEG:
+        await motion
+        return None
+    watch = _new_stall_watch(
+        _drivebase,
+        "drivebase",
+        stall_ms,
+        _drivebase.angle,
+        _drivebase_speed(3),
+        None,
+        _drivebase_setting(2),
+        STALL_ROTATION_TOLERANCE_DEG,
+        _drivebase_setting(3),
+    )
+    return await _run_with_stall(watch, motion)
+
+
+async def _run_arc_with_stall(
+    radius, angle, stop_param, use_curve=False, stall_ms=None
+):
+    """Run an arc/curve and abort if stalled."""
+    if _drivebase is None:
+        return None
+
+    arc_callable = _drivebase.curve if use_curve else _drivebase.arc
+    motion = arc_callable(radius, angle, then=stop_param, wait=True)
+    watch = _new_stall_watch(
+        _drivebase,
+        "drivebase",
+        stall_ms,
+        _drivebase.distance,
+        _drivebase_speed(1),
+        None,
+        _drivebase_setting(0),
+        STALL_PROGRESS_TOLERANCE_MM,
+        _drivebase_setting(1),
+    )
+    return await _run_with_stall(watch, motion)
+
+
+async def _run_motor_angle_with_stall(
+    motor, speed, angle, motor_name=None, stall_ms=None
+):
+    """Run a motor angle movement with stall detection."""
+    motion = motor.run_angle(speed, angle)
+    watch = _new_stall_watch(
+        motor,
+        motor_name,
+        stall_ms,
+        motor.angle,
+        motor.speed,
+        _motor_load_reader(motor_name),
+        speed,
+        STALL_ROTATION_TOLERANCE_DEG,
+        _motor_acceleration(motor),
+    )
+    return await _run_with_stall(watch, motion)
+
+
+# Command dispatch
+#
+# Every action maps to a handler coroutine in _command_handlers; a handler
+# takes the command dict and returns True when the command completed, False
+# when it was refused or aborted (which also aborts a running sequence).
+# register_command adds team-specific actions without editing this module.
+
+# Stop behavior names accepted in commands, mapped once to Pybricks values
+_STOP_BEHAVIORS = {
+    "hold": Stop.HOLD,
+    "coast_smart": Stop.COAST_SMART,
+    "coast": Stop.COAST,
+    "brake": Stop.BRAKE,
+}
+
+_command_debug = False  # Print every received command, step and movement
+
+# Motion actions whose stop behavior a sequence sets from their position
+_SEQUENCE_MOTION_ACTIONS = ("drive", "turn", "arc", "parallel")
+
+
+def set_command_debug(enabled):
+    """Print every received command, step and movement (off by default)."""
+    global _command_debug
+    _command_debug = bool(enabled)
+    print("[PILOT] Command debug", "enabled" if _command_debug else "disabled")
+
+
+def _stop_param(stop_behavior):
+    """Return the Pybricks Stop value for a stop_behavior name."""
+    return _STOP_BEHAVIORS.get(stop_behavior, Stop.HOLD)
+
+
+def register_command(name, handler):
+    """Register a handler coroutine for a custom command action.
+
+    The handler is awaited with the command dict, e.g.
+    {"action": "lift_arm", "height": 40}. Return False to report failure and
+    abort a running sequence; any other return value counts as completed.
+    Registering a built-in name replaces it.
+    """
+    _command_handlers[name] = handler
+    print("[PILOT] Registered command '" + name + "'")
+
+
+def _requires_drivebase(action):
+    """Report a drivebase command sent before register_drivebase."""
+    if _drivebase is None:
+        print("[PILOT] No drivebase registered for", action)
+        return True
+    return False
+
+
+# Drivebase settings and motion profiles
+#
+# _apply_drivebase_settings only calls DriveBase.settings() for values that
+# differ from the ones it last applied. Code that calls settings() itself
+# should call invalidate_drivebase_settings() afterwards; the hub menu does
+# this after every program. A motion profile names a set of settings (speed,
+# acceleration, turn rate, turn acceleration). Commands select one with
+# "profile": name or index, and an explicit "speed" overrides the profile's.
+
+_DRIVEBASE_SETTING_NAMES = (
+    "straight_speed",
+    "straight_acceleration",
+    "turn_rate",
+    "turn_acceleration",
+)
+_drivebase_settings = [None, None, None, None]  # Last applied; None if unknown
+_motion_profiles = []  # [name, settings tuple] in definition order
+
+
+def invalidate_drivebase_settings():
+    """Forget the cached drivebase settings so the next command reapplies them."""
+    for i in range(len(_drivebase_settings)):
+        _drivebase_settings[i] = None
+
+
+def _drivebase_setting(index):
+    """Return one drivebase setting, reading it back if it is not cached."""
+    if _drivebase_settings[index] is None and _drivebase is not None:
+        try:
+            current = _drivebase.settings()
+            for i in range(len(_drivebase_settings)):
+                _drivebase_settings[i] = current[i]
+        except Exception:
+            pass
+    return _drivebase_settings[index]
+
+
+def _apply_drivebase_settings(
+    straight_speed=None,
+    straight_acceleration=None,
+    turn_rate=None,
+    turn_acceleration=None,
+):
+    """Apply the given drivebase settings, skipping values already in effect."""
+    values = (straight_speed, straight_acceleration, turn_rate, turn_acceleration)
+    changed = None
+    for i in range(len(values)):
+        value = values[i]
+        if value is not None and value != _drivebase_settings[i]:
+            if changed is None:
+                changed = {}
+            changed[_DRIVEBASE_SETTING_NAMES[i]] = value
+            _drivebase_settings[i] = value
+    if changed:
+        try:
+            _drivebase.settings(**changed)
+        except Exception:
+            invalidate_drivebase_settings()
+            raise
+
+
+def define_motion_profile(
+    name, speed=None, acceleration=None, turn_rate=None, turn_acceleration=None
+):
+    """Define or replace a named motion profile and return its index.
+
+    Settings left as None are not changed when the profile is applied.
+    """
+    settings = (speed, acceleration, turn_rate, turn_acceleration)
+    for index, profile in enumerate(_motion_profiles):
+        if profile[0] == name:
+            profile[1] = settings
+            break
+    else:
+        index = len(_motion_profiles)
+        _motion_profiles.append([name, settings])
+    print("[PILOT:PROFILE]", json.dumps({"name": name, "index": index}))
+    return index
+
+
+def _motion_profile_index(ref):
+    """Return the index of a profile given by name or index, or None."""
+    if isinstance(ref, int):
+        return ref if 0 <= ref < len(_motion_profiles) else None
+    for index, profile in enumerate(_motion_profiles):
+        if profile[0] == ref:
+            return index
+    return None
+
+
+def _apply_motion_profile(index):
+    """Apply a motion profile's settings to the drivebase."""
+    _apply_drivebase_settings(*_motion_profiles[index][1])
+
+
+def _use_command_profile(command):
+    """Apply the profile a command names, if any; False if it is unknown."""
+    ref = command.get("profile")
+    if ref is None or _drivebase is None:
+        return True
+    index = _motion_profile_index(ref)
+    if index is None:
+        print("[PILOT] Unknown motion profile:", ref)
+        return False
+    _apply_motion_profile(index)
+    return True
+
+
+def _command_speed(command):
+    """Return a command's speed; None leaves its profile's speed in effect."""
+    return command.get("speed", None if "profile" in command else 100)
+
+
+async def _execute_single_command(command):
+    """Execute a single command through the handler registry."""
+    try:
+        action = command.get("action")
+        handler = _command_handlers.get(action)
+        if handler is None:
+            print("[PILOT] Unknown command action:", action)
+            return False
+        return await handler(command) is not False
+
+    except Exception as e:
+        print("[PILOT] Command execution error:", e)
+    return False
+
+
+async def _cmd_drive(command):
+    # Drive command: {"action": "drive", "distance": 100, "speed": 200, "stop_behavior": "hold"}
+    # With a motion profile: {"action": "drive", "distance": 100, "profile": "fast"}
+    if not _use_command_profile(command):
+        return False
+    return await _drive(
+        command.get("distance", 0),
+        _command_speed(command),
+        command.get("stop_behavior", "hold"),
+        command.get("stall_ms"),
+    )
+
+
+async def _drive(distance, speed, stop_behavior, stall_ms=None):
+    if _requires_drivebase("drive"):
+        return False
+
+    # Use straight() method with appropriate stop behavior; no speed keeps
+    # the current setting
+    if speed:
+        _apply_drivebase_settings(straight_speed=speed)
+    else:
+        speed = _drivebase_settings[0]
+    generation = _command_generation
+    stalled = await _run_drive_with_stall(
+        distance, _stop_param(stop_behavior), stall_ms
+    )
+    if stalled:
+        _emit_browser_alert(
+            "DRIVE_STALL",
+            "Drive movement "
+            + _stall_detail(stalled, "drivebase", stall_ms)
+            + ". Command aborted.",
+        )
+        print("[PILOT] Drive command aborted due to stall")
+        return False
+    if _command_generation != generation:
+        # Stopped before it arrived
+        return False
+    if _command_debug:
+        print(
+            "[PILOT] Executed drive:",
+            distance,
+            "mm at",
+            speed,
+            "mm/s with",
+            stop_behavior,
+        )
+    return True
+
+
+async def _cmd_turn(command):
+    # Turn command: {"action": "turn", "angle": 90, "speed": 100, "stop_behavior": "hold"}
+    if not _use_command_profile(command):
+        return False
+    return await _turn(
+        command.get("angle", 0),
+        _command_speed(command),
+        command.get("stop_behavior", "hold"),
+        command.get("stall_ms"),
+    )
+
+
+async def _turn(angle, speed, stop_behavior, stall_ms=None):
+    if _requires_drivebase("turn"):
+        return False
+
+    # Use turn() method with appropriate stop behavior
+    if speed:
+        _apply_drivebase_settings(turn_rate=speed)
+    else:
+        speed = _drivebase_settings[2]
+    generation = _command_generation
+    stalled = await _run_turn_with_stall(angle, _stop_param(stop_behavior), stall_ms)
+    if stalled:
+        _emit_browser_alert(
+            "TURN_STALL",
+            "Turn movement "
+            + _stall_detail(stalled, "drivebase", stall_ms)
+            + ". Command aborted.",
+        )
+        print("[PILOT] Turn command aborted due to stall")
+        return False
+    if _command_generation != generation:
+        return False
+    if _command_debug:
+        print(
+            "[PILOT] Executed turn:",
+            angle,
+            "° at",
+            speed,
+            "°/s with",
+            stop_behavior,
+        )
+    return True
+
+
+async def _cmd_stop(command):
+    # Stop command: {"action": "stop"} or {"action": "stop", "motor": "motor_name"}
+    return await _stop(command.get("motor"))
+
+
+async def _stop(motor_name):
+    # stop() returns at once, like drive()
+    if motor_name and motor_name in _motors:
+        # Stop specific motor
+        motor = _motors[motor_name]
+        motor.stop()
+        if _command_debug:
+            print("[PILOT] Stopped motor '" + motor_name + "'")
+    elif _drivebase:
+        _drivebase.stop()
+        if _command_debug:
+            print("[PILOT] Executed stop")
+    return True
+
+
+async def _cmd_drive_continuous(command):
+    # Continuous drive command: {"action": "drive_continuous", "speed": 100, "turn_rate": 0}
+    return await _drive_continuous(
+        command.get("speed", 0), command.get("turn_rate", 0)
+    )
+
+
+async def _drive_continuous(speed, turn_rate):
+    if _requires_drivebase("drive_continuous"):
+        return False
+    # Use drive() method for continuous movement; it returns at once
+    _drivebase.drive(speed, turn_rate)
+    if _command_debug:
+        print("[PILOT] Continuous drive:", speed, "mm/s, turn:", turn_rate, "°/s")
+    return True
+
+
+async def _cmd_turn_and_drive(command):
+    # Turn and drive command: {"action": "turn_and_drive", "angle": 90, "distance": 100, "speed": 200}
+    if _requires_drivebase("turn_and_drive") or not _use_command_profile(command):
+        return False
+    angle = command.get("angle", 0)
+    distance = command.get("distance", 0)
+    speed = _command_speed(command)
+    generation = _command_generation
+
+    # Execute turn first, then drive
+    if angle != 0:
+        if speed:
+            _apply_drivebase_settings(turn_rate=speed)
+        stalled_turn = await _run_turn_with_stall(
+            angle, Stop.COAST_SMART, command.get("stall_ms")
+        )
+        if stalled_turn:
+            _emit_browser_alert(
+                "TURN_STALL",
+                "Turn stalled during turn_and_drive sequence. Aborted.",
+            )
+            print("[PILOT] turn_and_drive aborted during turn due to stall")
+            return False
+        if _command_generation != generation:
+            return False
+
+    if distance != 0:
+        if speed:
+            _apply_drivebase_settings(straight_speed=speed)
+        stalled_drive = await _run_drive_with_stall(
+            distance,
+            _stop_param(command.get("stop_behavior", "hold")),
+            command.get("stall_ms"),
+        )
+        if stalled_drive:
+            _emit_browser_alert(
+                "DRIVE_STALL",
+                "Drive stalled during turn_and_drive sequence. Aborted.",
+            )
+            print("[PILOT] turn_and_drive aborted during drive due to stall")
+            return False
+        if _command_generation != generation:
+            return False
+    if _command_debug:
+        print(
+            "[PILOT] Executed turn_and_drive:",
+            angle,
+            "° then",
+            distance,
+            "mm at",
+            speed,
+            "units/s with",
+            command.get("stop_behavior", "hold"),
+        )
+    return True
+
+
+async def _cmd_arc(command):
+    # Arc command: {"action": "arc", "radius": 100, "angle": 90, "speed": 200}
+    # Use Pybricks drivebase arc method for smooth curved movement
+    angle = command.get("angle")
+
+    # For mission planning, we might get startAngle/endAngle instead of angle
+    start_angle = command.get("startAngle")
+    end_angle = command.get("endAngle")
+
+    if angle is None and start_angle is not None and end_angle is not None:
+        # Calculate sweep angle from start/end angles
+        angle = end_angle - start_angle
+        # Normalize to [-180, 180] range
+        while angle > 180:
+            angle -= 360
+        while angle < -180:
+            angle += 360
+
+    if angle is None:
+        print("[PILOT] Arc command missing angle parameter")
+        return False
+
+    if not _use_command_profile(command):
+        return False
+    return await _arc(
+        command.get("radius", 100),
+        angle,
+        _command_speed(command),
+        command.get("stop_behavior", "hold"),
+        command.get("stall_ms"),
+    )
+
+
+async def _arc(radius, angle, speed, stop_behavior, stall_ms=None):
+    if _requires_drivebase("arc"):
+        return False
+
+    # Use Pybricks drivebase arc method
+    if speed:
+        _apply_drivebase_settings(straight_speed=speed)
+    use_curve = not hasattr(_drivebase, "arc")
+    generation = _command_generation
+    stalled_arc = await _run_arc_with_stall(
+        radius,
+        angle,
+        _stop_param(stop_behavior),
+        use_curve=use_curve,
+        stall_ms=stall_ms,
+    )
+    if stalled_arc:
+        _emit_browser_alert(
+            "DRIVE_STALL",
+            "Arc movement "
+            + _stall_detail(stalled_arc, "drivebase", stall_ms)
+            + ". Command aborted.",
+        )
+        print("[PILOT] Arc command aborted due to stall")
+        return False
+    return _command_generation == generation
+
+
+async def _cmd_motor(command):
+    # Motor command: {"action": "motor", "motor": "left", "angle": 90, "speed": 100}
+    # Also support: {"action": "motor", "port": "A", "speed": 100}
+    return await _motor(
+        command.get("motor") or command.get("port"),
+        command.get("speed", 100),
+        command.get("angle"),
+        command.get("stall_ms"),
+    )
+
+
+async def _motor(motor_name, speed, angle, stall_ms=None):
+    if not motor_name or motor_name not in _motors:
+        print("[PILOT] Unknown motor:", motor_name)
+        return False
+
+    motor = _motors[motor_name]
+    if angle is not None:
+        generation = _command_generation
+        stalled_motor = await _run_motor_angle_with_stall(
+            motor,
+            speed,
+            angle,
+            motor_name,
+            stall_ms,
+        )
+        if stalled_motor:
+            _emit_browser_alert(
+                "MOTOR_STALL",
+                f"Motor '{motor_name}' "
+                + _stall_detail(stalled_motor, motor_name, stall_ms)
+                + ". Command aborted.",
+            )
+            print(
+                "[PILOT] Motor command aborted due to stall for",
+                motor_name,
+            )
+            return False
+        if _command_generation != generation:
+            return False
+        if _command_debug:
+            print(
+                "[PILOT] Motor '" + motor_name + "':",
+                angle,
+                "° at",
+                speed,
+                "°/s",
+            )
+    else:
+        # Continuous run; run() returns at once
+        motor.run(speed)
+        if _command_debug:
+            print("[PILOT] Motor '" + motor_name + "': running at", speed, "°/s")
+    return True
+
+
+async def _cmd_set_telemetry(command):
+    # Telemetry control: {"action": "set_telemetry", "enabled": true, "interval": 100, "format": "rows"}
+    # Delta mode: {"action": "set_telemetry", "format": "binary", "delta": true, "keyframe_interval": 20, "epsilon": {"hub.imu.heading": 0.5}}
+    # Sampling rates: {"action": "set_telemetry", "interval": 20, "rates": {"motors": 100, "hub.battery": 1000, "hub.system": "once"}}
+    # Missed deadlines: {"action": "set_telemetry", "schedule": "catch_up"}
+    # Subscription: {"action": "set_telemetry", "subscribe": ["drivebase", "hub.imu.heading"]} (null for everything)
+    # Batching: {"action": "set_telemetry", "format": "binary", "interval": 10, "batch": 10}
+    enabled = command.get("enabled", True)
+    interval = command.get("interval")
+    telemetry_format = command.get("format")
+    delta = command.get("delta")
+
+    set_telemetry_enabled(enabled)
+    # Format first: it decides the minimum interval
+    if telemetry_format:
+        set_telemetry_format(telemetry_format)
+    if interval:
+        set_telemetry_interval(interval)
+    batch = command.get("batch")
+    if batch:
+        set_telemetry_batch(batch)
+    if "subscribe" in command:
+        set_telemetry_subscription(command["subscribe"])
+    schedule = command.get("schedule")
+    if schedule:
+        set_telemetry_schedule(schedule)
+    rates = command.get("rates")
+    if rates:
+        for key in rates:
+            set_telemetry_rate(key, rates[key])
+    if delta is not None:
+        set_telemetry_delta(
+            delta,
+            command.get("keyframe_interval"),
+            command.get("epsilon"),
+        )
+    return True
+
+
+async def _cmd_get_telemetry_stats(command):
+    # Loop timing statistics: {"action": "get_telemetry_stats", "reset": true}
+    print("[PILOT:TELEMETRY_STATS]", json.dumps(get_telemetry_stats()))
+    if command.get("reset"):
+        reset_telemetry_stats()
+    return True
+
+
+async def _cmd_telemetry_keyframe(command):
+    # Resync after a missed delta frame: {"action": "telemetry_keyframe"}
+    request_telemetry_keyframe()
+    return True
+
+
+async def _cmd_set_sensor_mode(command):
+    # Color sensor sampling: {"action": "set_sensor_mode", "sensor": "color", "mode": "rotate"}
+    set_color_sensor_mode(command.get("sensor"), command.get("mode"))
+    return True
+
+
+async def _cmd_get_telemetry_schema(command):
+    # Schema request: {"action": "get_telemetry_schema"}
+    if _telemetry_schema is None:
+        _get_telemetry_schema()
+    else:
+        _announce_telemetry_schema()
+    return True
+
+
+async def _cmd_sequence(command):
+    # Sequence with an id: {"action": "sequence", "id": 7, "commands": [{"action": "drive", "distance": 100}, ...]}
+    # Blended: {"action": "sequence", "blend": true, "commands": [...]}
+    if command.get("blend"):
+        return await _execute_blended_sequence(command.get("commands", []))
+    return await _execute_command_sequence(command.get("commands", []))
+
+
+async def _cmd_follow_path(command):
+    # Pure pursuit: {"action": "follow_path", "points": [[0, 0], [200, 0], [400, 150]], "speed": 250, "lookahead": 80}
+    # Points are mm from the start pose (x ahead, y left); a flat [x0, y0, x1, y1, ...] list also works
+    return await follow_path(
+        pack_path(command.get("points", [])),
+        command.get("speed"),
+        command.get("lookahead"),
+        command.get("stall_ms"),
+    )
+
+
+async def _cmd_parallel(command):
+    # Concurrent members, usually inside a sequence:
+    # {"action": "parallel", "mode": "all", "commands": [{"action": "drive", "distance": 300},
+    #   {"action": "motor", "motor": "arm", "angle": 90, "speed": 300, "optional": true}]}
+    # "mode": "race" ends the group when the first member finishes
+    return await _execute_parallel_group(
+        command.get("commands", []),
+        command.get("mode") == "race",
+        command.get("stop_behavior"),
+    )
+
+
+async def _cmd_sequence_begin(command):
+    # Chunked sequence: {"action": "sequence_begin", "id": 7, "run": true}, then
+    # {"action": "sequence_append", "commands": [...]} chunks and {"action": "sequence_commit"}
+    global _sequence_stream
+
+    if _sequence_stream is not None:
+        print("[PILOT] Replacing unfinished sequence stream")
+    stream = {
+        "pending": [],
+        "committed": False,
+        "updated": get_time_ms(),
+        "started": False,
+        "id": command.get("id"),
+    }
+    _sequence_stream = stream
+    # Execute while receiving unless the host asks to wait for the commit
+    if command.get("run", True) and _command_executor_active:
+        _start_sequence_stream(stream)
+    return True
+
+
+async def _cmd_sequence_append(command):
+    # Sequence chunk: {"action": "sequence_append", "commands": [{"action": "drive", "distance": 100}, ...]}
+    stream = _sequence_stream
+    if stream is None or stream["committed"]:
+        print("[PILOT] No open sequence stream")
+        return False
+    stream["pending"].extend(command.get("commands", []))
+    stream["updated"] = get_time_ms()
+    return True
+
+
+async def _cmd_sequence_commit(command):
+    # End of a chunked sequence: {"action": "sequence_commit"}
+    stream = _sequence_stream
+    if stream is None or stream["committed"]:
+        print("[PILOT] No open sequence stream")
+        return False
+    stream["committed"] = True
+    stream["updated"] = get_time_ms()
+    if not stream["started"]:
+        if _command_executor_active:
+            _start_sequence_stream(stream)
+        else:
+            # Inline process_commands: run it here
+            stream["started"] = True
+            return await _run_sequence_stream(stream)
+    return True
+
+
+def _start_sequence_stream(stream):
+    """Queue the runner for a stream; its events use the sequence_begin id."""
+    stream["started"] = True
+    runner = {"action": "sequence_stream"}
+    if stream["id"] is not None:
+        runner["id"] = stream["id"]
+    _command_queue.append((runner, get_time_ms()))
+
+
+async def _cmd_sequence_stream(command):
+    # Queued by sequence_begin or sequence_commit to run the current stream
+    if _sequence_stream is None:
+        print("[PILOT] No sequence stream to run")
+        return False
+    return await _run_sequence_stream(_sequence_stream)
+
+
+async def _run_sequence_stream(stream):
+    """Execute a chunked sequence while its later chunks are still arriving.
+
+    The newest received command is held back until another one or the commit
+    arrives, so only the true last command ends in HOLD. Executed commands are
+    dropped at once, so RAM only holds what has not run yet.
+    """
+    global _sequence_stream
+
+    pending = stream["pending"]
+    number = 0
+    print("[PILOT] Executing streamed command sequence")
+    try:
+        while _sequence_stream is stream:
+            if len(pending) > 1 or (stream["committed"] and pending):
+                cmd = pending.pop(0)
+                number += 1
+                is_last = stream["committed"] and not pending
+                completed = await _execute_sequence_step(cmd, is_last, number)
+                if not completed or _command_cancel:
+                    _sequence_aborted()
+                    break
+            elif stream["committed"]:
+                print("[PILOT] Command sequence completed:", number, "commands")
+                _sequence_stream = None
+                return True
+            elif get_time_ms() - stream["updated"] > _SEQUENCE_STREAM_TIMEOUT_MS:
+                _emit_browser_alert(
+                    "SEQUENCE_STREAM_TIMEOUT",
+                    f"No sequence chunk for {_SEQUENCE_STREAM_TIMEOUT_MS} ms."
+                    " Sequence aborted.",
+                )
+                break
+            else:
+                # Waiting for the next chunk
+                await wait(COMMAND_POLL_MS)
+    except Exception as e:
+        print("[PILOT] Command sequence error:", e)
+
+    if _sequence_stream is stream:
+        _sequence_stream = None
+    return False
+
+
+async def _cmd_store_sequence(command):
+    # Cache a sequence on the hub: {"action": "store_sequence", "name": "mission1", "commands": [...]}
+    return store_sequence(command.get("name"), command.get("commands", []))
+
+
+async def _cmd_run_sequence(command):
+    # Run a cached sequence: {"action": "run_sequence", "name": "mission1"}
+    return await run_sequence(command.get("name"))
+
+
+async def _cmd_delete_sequence(command):
+    # Drop a cached sequence: {"action": "delete_sequence", "name": "mission1"}
+    delete_sequence(command.get("name"))
+    return True
+
+
+async def _cmd_list_sequences(command):
+    # Cached sequence names, most recently used last: {"action": "list_sequences"}
+    print(
+        "[PILOT:SEQUENCES]",
+        json.dumps(
+            {
+                "names": [entry[0] for entry in _sequence_cache],
+                "bytes": _sequence_cache_used,
+                "capacity": _SEQUENCE_CACHE_BYTES,
+            }
+        ),
+    )
+    return True
+
+
+async def _cmd_get_command_stats(command):
+    # Queue wait and execution time per action: {"action": "get_command_stats", "reset": true}
+    print("[PILOT:COMMAND_STATS]", json.dumps(get_command_stats()))
+    if command.get("reset"):
+        reset_command_stats()
+    return True
+
+
+async def _cmd_set_command_format(command):
+    # Command encoding for this session: {"action": "set_command_format", "format": "binary"}
+    set_command_format(command.get("format", "json"))
+    return True
+
+
+async def _cmd_set_teleop(command):
+    # Teleop streaming: {"action": "set_teleop", "enabled": true, "rate": 20, "timeout": 500}
+    set_teleop(
+        command.get("enabled", True), command.get("rate"), command.get("timeout")
+    )
+    return True
+
+
+async def _cmd_define_profile(command):
+    # Motion profile: {"action": "define_profile", "name": "fast", "speed": 400, "acceleration": 800, "turn_rate": 200, "turn_acceleration": 600}
+    define_motion_profile(
+        command.get("name"),
+        command.get("speed"),
+        command.get("acceleration"),
+        command.get("turn_rate"),
+        command.get("turn_acceleration"),
+    )
+    return True
+
+
+async def _cmd_set_stall_threshold(command):
+    # Stall duration per device: {"action": "set_stall_threshold", "device": "arm", "ms": 1500} (null ms resets)
+    # Per command instead: {"action": "motor", "motor": "arm", "angle": 90, "stall_ms": 300}
+    set_stall_threshold(command.get("device", "drivebase"), command.get("ms"))
+    return True
+
+
+async def _cmd_set_stall_sensitivity(command):
+    # Early stall checks: {"action": "set_stall_sensitivity", "early_ms": 250, "speed_ratio": 0.2, "load_mnm": 100}
+    # "early_ms": 0 leaves only the stalled() duration check
+    set_stall_sensitivity(
+        command.get("early_ms"), command.get("speed_ratio"), command.get("load_mnm")
+    )
+    return True
+
+
+async def _cmd_set_debug(command):
+    # Verbose command logging: {"action": "set_debug", "enabled": true}
+    set_command_debug(command.get("enabled", True))
+    return True
+
+
+async def _cmd_reset_drivebase(command):
+    # Reset drivebase telemetry: {"action": "reset_drivebase"}
+    if _requires_drivebase("reset_drivebase"):
+        return False
+    try:
+        _drivebase.reset()
+        _hub.imu.reset_heading(0)
+        for motor in _motors:
+            _motors[motor].reset_angle(0)
+        print("[PILOT] Drivebase telemetry reset - distance and angle set to 0")
+    except Exception as e:
+        print("[PILOT] Drivebase reset error:", e)
+    return True
+
+
+async def _cmd_select_program(command):
+    # Select a specific program in the menu: {"action": "select_program", "program_number": 1}
+    global _menu_current_index
+
+    if not _menu_active:
+        print("[PILOT:MENU] Menu not active")
+        return False
+    program_number = command.get("program_number")
+    if program_number:
+        for i, prog in enumerate(_menu_programs):
+            if prog["num"] == program_number:
+                _menu_current_index = i
+                if _hub:
+                    _hub.display.number(prog["num"])
+                print("[PILOT:MENU] UI selected:", prog["name"])
+                _send_menu_status()
+                break
+    return True
+
+
+async def _cmd_run_selected(command):
+    # Run the currently selected program: {"action": "run_selected"}
+    # The menu loop runs it; this only sets the flag it checks
+    global _menu_run_requested
+
+    if not _menu_active or _menu_state != "menu":
+        print("[PILOT:MENU] Menu not ready to run a program")
+        return False
+    print("[PILOT:MENU] UI requested run")
+    _menu_run_requested = True
+    return True
+
+
+# Action name -> handler coroutine; extended by register_command
+_command_handlers = {
+    "drive": _cmd_drive,
+    "turn": _cmd_turn,
+    "stop": _cmd_stop,
+    "drive_continuous": _cmd_drive_continuous,
+    "turn_and_drive": _cmd_turn_and_drive,
+    "arc": _cmd_arc,
+    "motor": _cmd_motor,
+    "set_telemetry": _cmd_set_telemetry,
+    "get_telemetry_stats": _cmd_get_telemetry_stats,
+    "telemetry_keyframe": _cmd_telemetry_keyframe,
+    "set_sensor_mode": _cmd_set_sensor_mode,
+    "get_telemetry_schema": _cmd_get_telemetry_schema,
+    "set_debug": _cmd_set_debug,
+    "set_stall_threshold": _cmd_set_stall_threshold,
+    "set_stall_sensitivity": _cmd_set_stall_sensitivity,
+    "define_profile": _cmd_define_profile,
+    "set_teleop": _cmd_set_teleop,
+    "set_command_format": _cmd_set_command_format,
+    "sequence": _cmd_sequence,
+    "parallel": _cmd_parallel,
+    "follow_path": _cmd_follow_path,
+    "sequence_begin": _cmd_sequence_begin,
+    "sequence_append": _cmd_sequence_append,
+    "sequence_commit": _cmd_sequence_commit,
+    "sequence_stream": _cmd_sequence_stream,
+    "store_sequence": _cmd_store_sequence,
+    "run_sequence": _cmd_run_sequence,
+    "delete_sequence": _cmd_delete_sequence,
+    "list_sequences": _cmd_list_sequences,
+    "get_command_stats": _cmd_get_command_stats,
+    "reset_drivebase": _cmd_reset_drivebase,
+    "select_program": _cmd_select_program,
+    "run_selected": _cmd_run_selected,
+}
+
+
+# Binary command protocol
+#
+# After {"action": "set_command_format", "format": "binary"} commands may also
+# arrive as frames: STX (0x02) at the start of a line, the payload length as
+# uint16, then the payload. JSON lines keep working in between. A payload is
+# an opcode byte, a uint16 id when the opcode has bit 7 set, and the opcode's
+# arguments, all little endian:
+#   0x01 drive             <hhB   distance mm, speed mm/s, stop
+#   0x02 turn              <hhB   angle deg, speed deg/s, stop
+#   0x03 arc               <hhhB  radius mm, angle deg, speed mm/s, stop
+#   0x04 motor             <BBhi  motor, has angle, speed deg/s, angle deg
+#   0x05 stop              <B     motor, 255 for the drivebase
+#   0x06 drive_continuous  <hh    speed mm/s, turn rate deg/s
+#   0x07 set_telemetry     <BBH   enabled, format, interval ms (0 keeps it)
+#   0x08 sequence          commands back to back, opcode and arguments, no id
+#   0x09 json              <H     length, then a UTF-8 JSON command (in
+#                                 sequences, for actions without an opcode)
+#   0x0A profile           <B     apply motion profile by index
+# A speed of 0 in drive, turn or arc keeps the speed currently in effect.
+# stop indexes _STOP_BEHAVIOR_CODES, format indexes _TELEMETRY_FORMAT_CODES
+# and motor is the registration index listed in the [PILOT:COMMAND_FORMAT]
+# reply. Frame payloads are opaque, so EMERGENCY_STOP_BYTE is only seen
+# between frames. A length above _COMMAND_BUFFER_SIZE is rejected at the
+# header. A frame whose bytes stop for COMMAND_FRAME_TIMEOUT_MS is dropped.
+
+_BINARY_ID_FLAG = 0x80
+_BINARY_OPCODE_MASK = 0x7F
+_BINARY_SEQUENCE = 0x08
+_BINARY_JSON = 0x09
+_STOP_BEHAVIOR_CODES = ("hold", "coast_smart", "coast", "brake")
+_TELEMETRY_FORMAT_CODES = (None, "json", "rows", "binary")  # None keeps it
+
+
+def set_command_format(command_format):
+    """Accept binary command frames ("binary") or JSON lines only ("json")."""
+    global _command_format
+    if command_format not in ("json", "binary"):
+        print("[PILOT] Unknown command format:", command_format)
+        return
+    _command_format = command_format
+    print(
+        "[PILOT:COMMAND_FORMAT]",
+        json.dumps({"format": command_format, "version": 1, "motors": _motor_names}),
+    )
+
+
+def _binary_motor_name(index):
+    """Return the motor name for a binary motor index, or None if unknown."""
+    if index < len(_motor_names):
+        return _motor_names[index]
+    print("[PILOT] Unknown motor index:", index)
+    return None
+
+
+async def _bin_drive(distance, speed, stop):
+    return await _drive(distance, speed, _STOP_BEHAVIOR_CODES[stop])
+
+
+async def _bin_turn(angle, speed, stop):
+    return await _turn(angle, speed, _STOP_BEHAVIOR_CODES[stop])
+
+
+async def _bin_arc(radius, angle, speed, stop):
+    return await _arc(radius, angle, speed, _STOP_BEHAVIOR_CODES[stop])
+
 
-    except Exception as e:
-        print("[PILOT] Command execution error:", e)
+async def _bin_motor(index, has_angle, speed, angle):
+    name = _binary_motor_name(index)
+    if name is None:
+        return False
+    return await _motor(name, speed, angle if has_angle else None)
 
 
-async def _run_drive_with_stall(distance, stop_param):
-    """Run straight movement and abort if the drivebase remains stalled."""
-    if _drivebase is None:
+async def _bin_stop(index):
+    if index == 255:
+        return await _stop(None)
+    name = _binary_motor_name(index)
+    if name is None:
         return False
+    return await _stop(name)
 
-    if abs(distance) <= STALL_PROGRESS_TOLERANCE_MM:
-        await _drivebase.straight(distance, then=stop_param, wait=True)
+
+async def _bin_profile(index):
+    if _drivebase is None or index >= len(_motion_profiles):
+        print("[PILOT] Unknown motion profile:", index)
         return False
+    _apply_motion_profile(index)
+    return True
 
-    async def drive_task():
-        await _drivebase.straight(distance, then=stop_param, wait=True)
 
-    async def monitor_task():
-        stall_start = None
-        try:
-            while True:
-                await wait(STALL_CHECK_INTERVAL_MS)
-                if _drivebase is None:
-                    return
-                if _drivebase.stalled():
-                    if stall_start is None:
-                        stall_start = get_time_ms()
-                    elif get_time_ms() - stall_start >= STALL_DURATION_MS:
-                        raise StallDetected()
-                else:
-                    stall_start = None
-        except StallDetected:
-            raise
-        except BaseException:
-            return
+async def _bin_set_telemetry(enabled, format_code, interval):
+    set_telemetry_enabled(bool(enabled))
+    # Format first: it decides the minimum interval
+    telemetry_format = None
+    if format_code < len(_TELEMETRY_FORMAT_CODES):
+        telemetry_format = _TELEMETRY_FORMAT_CODES[format_code]
+    if telemetry_format:
+        set_telemetry_format(telemetry_format)
+    if interval:
+        set_telemetry_interval(interval)
+    return True
 
-    try:
-        await multitask(drive_task(), monitor_task(), race=True)
-        return False
-    except StallDetected:
-        try:
-            await _drivebase.stop()
-        except Exception:
-            pass
-        return True
 
+def _binary_command(name, fmt, handler):
+    return (name, fmt, struct.calcsize(fmt), handler)
 
-async def _run_turn_with_stall(angle, stop_param):
-    """Run a turn and abort if the drivebase stalls."""
-    if _drivebase is None:
-        return False
 
-    if abs(angle) <= STALL_ROTATION_TOLERANCE_DEG:
-        await _drivebase.turn(angle, then=stop_param, wait=True)
-        return False
+# Opcode -> (action name, argument format, argument size, handler)
+_BINARY_COMMANDS = {
+    0x01: _binary_command("drive", "<hhB", _bin_drive),
+    0x02: _binary_command("turn", "<hhB", _bin_turn),
+    0x03: _binary_command("arc", "<hhhB", _bin_arc),
+    0x04: _binary_command("motor", "<BBhi", _bin_motor),
+    0x05: _binary_command("stop", "<B", _bin_stop),
+    0x06: _binary_command("drive_continuous", "<hh", _drive_continuous),
+    0x07: _binary_command("set_telemetry", "<BBH", _bin_set_telemetry),
+    0x0A: _binary_command("profile", "<B", _bin_profile),
+}
 
-    async def turn_task():
-        await _drivebase.turn(angle, then=stop_param, wait=True)
 
-    async def monitor_task():
-        stall_start = None
-        try:
-            while True:
-                await wait(STALL_CHECK_INTERVAL_MS)
-                if _drivebase is None:
-                    return
-                if _drivebase.stalled():
-                    if stall_start is None:
-                        stall_start = get_time_ms()
-                    elif get_time_ms() - stall_start >= STALL_DURATION_MS:
-                        raise StallDetected()
-                else:
-                    stall_start = None
-        except StallDetected:
-            raise
-        except BaseException:
-            return
+def _parse_command(data):
+    """Parse a JSON line; binary frame payloads stay bytes until they run."""
+    if isinstance(data, bytes):
+        return data
+    return json.loads(data)
+
+
+def _binary_action(payload):
+    """Return the action name of a binary command payload."""
+    opcode = payload[0] & _BINARY_OPCODE_MASK
+    if opcode == _BINARY_SEQUENCE:
+        return "sequence"
+    entry = _BINARY_COMMANDS.get(opcode)
+    return entry[0] if entry else "unknown"
+
 
+def _stop_kind(command):
+    """Return "all" for a drivebase stop, "motor" for a motor stop, else None.
+
+    The browser wraps single commands in a list, so [stop] counts as a stop.
+    """
+    if isinstance(command, list) and len(command) == 1:
+        command = command[0]
+    if isinstance(command, dict):
+        if command.get("action") != "stop":
+            return None
+        return "motor" if command.get("motor") else "all"
+    if isinstance(command, bytes) and len(command) > 1:
+        if command[0] & _BINARY_OPCODE_MASK != 0x05:
+            return None
+        offset = 3 if command[0] & _BINARY_ID_FLAG else 1
+        return "all" if command[offset] == 255 else "motor"
+    return None
+
+
+async def _execute_binary_command(payload):
+    """Decode a binary command payload straight into its handler call."""
     try:
-        await multitask(turn_task(), monitor_task(), race=True)
-        return False
-    except StallDetected:
-        try:
-            await _drivebase.stop()
-        except Exception:
-            pass
-        return True
+        opcode = payload[0]
+        offset = 3 if opcode & _BINARY_ID_FLAG else 1
+        opcode &= _BINARY_OPCODE_MASK
+        if opcode == _BINARY_SEQUENCE:
+            return await _execute_binary_sequence(payload, offset)
+        entry = _BINARY_COMMANDS.get(opcode)
+        if entry is None:
+            print("[PILOT] Unknown command opcode:", opcode)
+            return False
+        args = struct.unpack_from(entry[1], payload, offset)
+        return await entry[3](*args) is not False
 
+    except Exception as e:
+        print("[PILOT] Binary command error:", e)
+    return False
 
-async def _run_arc_with_stall(radius, angle, stop_param, use_curve=False):
-    """Run an arc/curve and abort if stalled."""
-    if _drivebase is None:
+
+async def _execute_binary_sequence(payload, offset):
+    """Run packed commands back to back; stop behaviors come from the host."""
+    print("[PILOT] Executing binary command sequence")
+    end = len(payload)
+    while offset < end:
+        if _command_cancel:
+            return _sequence_aborted()
+        opcode = payload[offset]
+        if opcode == _BINARY_JSON:
+            length = struct.unpack_from("<H", payload, offset + 1)[0]
+            offset += 3 + length
+            text = bytes(payload[offset - length : offset]).decode()
+            completed = await _execute_single_command(json.loads(text))
+        else:
+            entry = _BINARY_COMMANDS.get(opcode)
+            if entry is None:
+                print("[PILOT] Unknown command opcode:", opcode)
+                return False
+            args = struct.unpack_from(entry[1], payload, offset + 1)
+            offset += 1 + entry[2]
+            completed = await entry[3](*args) is not False
+        if not completed or _command_cancel:
+            return _sequence_aborted()
+    print("[PILOT] Command sequence completed")
+    return True
+
+
+# Sequence cache
+#
+# store_sequence packs a JSON sequence once into the binary sequence encoding:
+# opcodes with int16 arguments, stop behaviors already fixed by position
+# (coast_smart, hold for the last command), motors as registration indices.
+# Actions without an opcode, commands with a "stall_ms", and values outside
+# the int16 range are kept as JSON text (opcode 0x09). Known motion profiles
+# become a profile opcode. Distances and angles are rounded to whole mm and
+# degrees. Stored sequences live for the program session. The cache lists
+# them least recently used first, and the oldest are evicted once
+# _SEQUENCE_CACHE_BYTES would be exceeded.
+
+_SEQUENCE_CACHE_BYTES = 16384
+_sequence_cache = []  # [name, packed sequence], least recently used first
+_sequence_cache_used = 0  # Bytes held by _sequence_cache
+
+
+def _int16(value):
+    """Round a number to int16, or return None when it does not fit."""
+    value = int(round(value))
+    if -32768 <= value <= 32767:
+        return value
+    return None
+
+
+def _pack_drive(cmd, stop):
+    distance = _int16(cmd.get("distance", 0))
+    speed = _int16(cmd.get("speed", 100))
+    if distance is None or speed is None:
+        return None
+    return b"\x01" + struct.pack("<hhB", distance, speed, stop)
+
+
+def _pack_turn(cmd, stop):
+    angle = _int16(cmd.get("angle", 0))
+    speed = _int16(cmd.get("speed", 100))
+    if angle is None or speed is None:
+        return None
+    return b"\x02" + struct.pack("<hhB", angle, speed, stop)
+
+
+def _pack_arc(cmd, stop):
+    angle = cmd.get("angle")
+    if angle is None:
+        # startAngle/endAngle arcs are resolved when they run
+        return None
+    radius = _int16(cmd.get("radius", 100))
+    angle = _int16(angle)
+    speed = _int16(cmd.get("speed", 100))
+    if radius is None or angle is None or speed is None:
+        return None
+    return b"\x03" + struct.pack("<hhhB", radius, angle, speed, stop)
+
+
+def _pack_motor(cmd, stop):
+    name = cmd.get("motor") or cmd.get("port")
+    speed = _int16(cmd.get("speed", 100))
+    angle = cmd.get("angle")
+    if name not in _motor_names or speed is None:
+        return None
+    index = _motor_names.index(name)
+    if angle is None:
+        return b"\x04" + struct.pack("<BBhi", index, 0, speed, 0)
+    return b"\x04" + struct.pack("<BBhi", index, 1, speed, int(round(angle)))
+
+
+def _pack_stop(cmd, stop):
+    name = cmd.get("motor")
+    if not name:
+        return b"\x05\xff"
+    if name not in _motor_names:
+        return None
+    return b"\x05" + struct.pack("<B", _motor_names.index(name))
+
+
+# Action -> packer(command, stop code) returning bytes, or None to keep JSON
+_SEQUENCE_PACKERS = {
+    "drive": _pack_drive,
+    "turn": _pack_turn,
+    "arc": _pack_arc,
+    "motor": _pack_motor,
+    "stop": _pack_stop,
+}
+
+
+def _pack_sequence(commands):
+    """Pack a JSON command sequence for the cache."""
+    last = len(commands) - 1
+    parts = []
+    for i, cmd in enumerate(commands):
+        packer = _SEQUENCE_PACKERS.get(cmd.get("action"))
+        if "stall_ms" in cmd:
+            packer = None  # The opcodes have no stall field
+        packed = None
+        profile = None
+        if "profile" in cmd:
+            profile = _motion_profile_index(cmd["profile"])
+            if profile is None:
+                # Unknown so far; resolve it by name when it runs
+                packer = None
+            elif "speed" not in cmd:
+                cmd = cmd.copy()
+                cmd["speed"] = 0  # Keep the profile's speed
+        if packer is not None:
+            try:
+                packed = packer(cmd, 0 if i == last else 1)  # hold / coast_smart
+            except (TypeError, ValueError):
+                packed = None
+        if packed is not None and profile is not None:
+            packed = struct.pack("<BB", 0x0A, profile) + packed
+        if packed is None:
+            if cmd.get("action") in _SEQUENCE_MOTION_ACTIONS:
+                cmd = cmd.copy()
+                cmd["stop_behavior"] = "hold" if i == last else "coast_smart"
+            text = json.dumps(cmd).encode()
+            packed = struct.pack("<BH", _BINARY_JSON, len(text)) + text
+        parts.append(packed)
+    return b"".join(parts)
+
+
+def store_sequence(name, commands):
+    """Store a command sequence on the hub under name; False if too large."""
+    global _sequence_cache_used
+
+    delete_sequence(name)
+    packed = _pack_sequence(commands)
+    if len(packed) > _SEQUENCE_CACHE_BYTES:
+        _emit_browser_alert(
+            "SEQUENCE_TOO_LARGE",
+            f"Sequence '{name}' needs {len(packed)} bytes; the cache holds "
+            f"{_SEQUENCE_CACHE_BYTES}.",
+        )
         return False
+    while _sequence_cache_used + len(packed) > _SEQUENCE_CACHE_BYTES:
+        evicted = _sequence_cache.pop(0)
+        _sequence_cache_used -= len(evicted[1])
+        print("[PILOT] Evicted cached sequence:", evicted[0])
+    _sequence_cache.append([name, packed])
+    _sequence_cache_used += len(packed)
+    print(
+        "[PILOT:SEQUENCE_STORED]",
+        json.dumps({"name": name, "commands": len(commands), "bytes": len(packed)}),
+    )
+    return True
 
-    arc_callable = _drivebase.curve if use_curve else _drivebase.arc
-    async def arc_task():
-        await arc_callable(radius, angle, then=stop_param, wait=True)
 
-    async def monitor_task():
-        stall_start = None
-        try:
-            while True:
-                await wait(STALL_CHECK_INTERVAL_MS)
-                if _drivebase is None:
-                    return
-                if _drivebase.stalled():
-                    if stall_start is None:
-                        stall_start = get_time_ms()
-                    elif get_time_ms() - stall_start >= STALL_DURATION_MS:
-                        raise StallDetected()
-                else:
-                    stall_start = None
-        except StallDetected:
-            raise
-        except BaseException:
-            return
+def delete_sequence(name):
+    """Remove a stored sequence; True if it existed."""
+    global _sequence_cache_used
 
-    try:
-        await multitask(arc_task(), monitor_task(), race=True)
-        return False
-    except StallDetected:
-        try:
-            await _drivebase.stop()
-        except Exception:
-            pass
-        return True
+    for i, entry in enumerate(_sequence_cache):
+        if entry[0] == name:
+            _sequence_cache_used -= len(entry[1])
+            del _sequence_cache[i]
+            return True
+    return False
 
 
-async def _run_motor_angle_with_stall(motor, speed, angle):
-    """Run a motor angle movement with stall detection."""
-    async def motor_task():
-        await motor.run_angle(speed, angle)
+def _cached_sequence(name):
+    """Return a stored sequence and mark it most recently used, or None."""
+    for i, entry in enumerate(_sequence_cache):
+        if entry[0] == name:
+            if i != len(_sequence_cache) - 1:
+                del _sequence_cache[i]
+                _sequence_cache.append(entry)
+            return entry[1]
+    return None
 
-    async def monitor_task():
-        stall_start = None
-        try:
-            while True:
-                await wait(STALL_CHECK_INTERVAL_MS)
-                if motor.stalled():
-                    if stall_start is None:
-                        stall_start = get_time_ms()
-                    elif get_time_ms() - stall_start >= STALL_DURATION_MS:
-                        raise StallDetected()
-                else:
-                    stall_start = None
-        except StallDetected:
-            raise
-        except BaseException:
-            return
 
-    try:
-        await multitask(motor_task(), monitor_task(), race=True)
+async def run_sequence(name):
+    """Run a stored sequence; False if it is unknown or did not complete."""
+    packed = _cached_sequence(name)
+    if packed is None:
+        print("[PILOT] Unknown sequence:", name)
         return False
-    except StallDetected:
-        try:
-            await motor.stop()
-        except Exception:
-            pass
-        return True
-async def _execute_single_command(command):
-    """Execute a single command with optional stop behavior."""
     try:
-        action = command.get("action")
-        stop_behavior = command.get(
-            "stop_behavior", "hold"
-        )  # Default to hold for single commands
+        return await _execute_binary_sequence(packed, 0)
+    except Exception as e:
+        print("[PILOT] Command sequence error:", e)
+    return False
 
-        # Debug: Print drivebase status for troubleshooting
-        if action in ["drive", "turn", "arc", "stop"]:
-            print(
-                "[PILOT] Command:",
-                action,
-                "- Drivebase registered:",
-                _drivebase is not None,
-                "- Stop behavior:",
-                stop_behavior,
-            )
 
-        if action == "drive" and _drivebase:
-            # Drive command: {"action": "drive", "distance": 100, "speed": 200, "stop_behavior": "hold"}
-            distance = command.get("distance", 0)
-            speed = command.get("speed", 100)
-
-            # Convert stop behavior string to Pybricks Stop parameter
-            stop_param = Stop.HOLD  # Default
-            if stop_behavior == "coast_smart":
-                stop_param = Stop.COAST_SMART
-            elif stop_behavior == "coast":
-                stop_param = Stop.COAST
-            elif stop_behavior == "brake":
-                stop_param = Stop.BRAKE
-
-            # Use straight() method with appropriate stop behavior
-            _drivebase.settings(straight_speed=speed)
-            stalled = await _run_drive_with_stall(distance, stop_param)
-            if stalled:
-                _emit_browser_alert(
-                    "DRIVE_STALL",
-                    "Drive movement stalled for over 1s. Command aborted.",
-                )
-                print("[PILOT] Drive command aborted due to stall")
-                return False
-            print(
-                "[PILOT] Executed drive:",
-                distance,
-                "mm at",
-                speed,
-                "mm/s with",
-                stop_behavior,
-            )
-            return True
+async def process_commands():
+    """Process any incoming commands from stdin using non-blocking read_input_byte.
 
-        elif action == "turn" and _drivebase:
-            # Turn command: {"action": "turn", "angle": 90, "speed": 100, "stop_behavior": "hold"}
-            angle = command.get("angle", 0)
-            speed = command.get("speed", 100)
-
-            # Convert stop behavior string to Pybricks Stop parameter
-            stop_param = Stop.HOLD  # Default
-            if stop_behavior == "coast_smart":
-                stop_param = Stop.COAST_SMART
-            elif stop_behavior == "coast":
-                stop_param = Stop.COAST
-            elif stop_behavior == "brake":
-                stop_param = Stop.BRAKE
-
-            # Use turn() method with appropriate stop behavior
-            _drivebase.settings(turn_rate=speed)
-            stalled = await _run_turn_with_stall(angle, stop_param)
-            if stalled:
-                _emit_browser_alert(
-                    "TURN_STALL",
-                    "Turn movement stalled for over 1s. Command aborted.",
-                )
-                print("[PILOT] Turn command aborted due to stall")
-                return False
-            print(
-                "[PILOT] Executed turn:",
-                angle,
-                "° at",
-                speed,
-                "°/s with",
-                stop_behavior,
-            )
-            return True
+    Commands run inline, one after another, before this returns. Use
+    background_command_task instead to keep reading while a motion runs.
+    """
+    await _read_command_lines(_process_command_line)
 
-        elif action == "stop":
-            # Stop command: {"action": "stop"} or {"action": "stop", "motor": "motor_name"}
-            motor_name = command.get("motor")
-            if motor_name and motor_name in _motors:
-                # Stop specific motor
-                motor = _motors[motor_name]
-                await motor.stop()
-                print("[PILOT] Stopped motor '" + motor_name + "'")
-            elif _drivebase:
-                await _drivebase.stop()
-                print("[PILOT] Executed stop")
-            return True
 
-        elif action == "drive_continuous" and _drivebase:
-            # Continuous drive command: {"action": "drive_continuous", "speed": 100, "turn_rate": 0}
-            speed = command.get("speed", 0)
-            turn_rate = command.get("turn_rate", 0)
-            # Use drive() method for continuous movement
-            await _drivebase.drive(speed, turn_rate)
-            print("[PILOT] Continuous drive:", speed, "mm/s, turn:", turn_rate, "°/s")
-            return True
+async def _read_command_lines(on_line):
+    """Drain available input and await on_line for every complete line.
 
-        elif action == "turn_and_drive" and _drivebase:
-            # Turn and drive command: {"action": "turn_and_drive", "angle": 90, "distance": 100, "speed": 200}
-            angle = command.get("angle", 0)
-            distance = command.get("distance", 0)
-            speed = command.get("speed", 100)
-
-            # Convert stop behavior string to Pybricks Stop parameter
-            stop_param = Stop.HOLD  # Default
-            stop_behavior = command.get("stop_behavior", "hold")
-            if stop_behavior == "coast_smart":
-                stop_param = Stop.COAST_SMART
-            elif stop_behavior == "coast":
-                stop_param = Stop.COAST
-            elif stop_behavior == "brake":
-                stop_param = Stop.BRAKE
-
-            # Execute turn first, then drive
-            if angle != 0:
-                _drivebase.settings(turn_rate=speed)
-                stalled_turn = await _run_turn_with_stall(angle, Stop.COAST_SMART)
-                if stalled_turn:
-                    _emit_browser_alert(
-                        "TURN_STALL",
-                        "Turn stalled during turn_and_drive sequence. Aborted.",
-                    )
-                    print("[PILOT] turn_and_drive aborted during turn due to stall")
-                    return False
+    on_line gets a str for a text line and bytes for a binary frame payload.
+    Bytes go straight into a preallocated buffer and every complete line is
+    decoded once. Reading yields to other tasks after each budget of bytes;
+    the budget doubles while input keeps coming and halves on each call
+    that finds no input at all.
+    """
+    global _command_length, _command_overflow, _command_read_budget
+    global _command_discard, _command_frame_header, _command_frame_remaining
+    global _command_frame_updated
 
-            if distance != 0:
-                _drivebase.settings(straight_speed=speed)
-                stalled_drive = await _run_drive_with_stall(distance, stop_param)
-                if stalled_drive:
-                    _emit_browser_alert(
-                        "DRIVE_STALL",
-                        "Drive stalled during turn_and_drive sequence. Aborted.",
-                    )
-                    print("[PILOT] turn_and_drive aborted during drive due to stall")
-                    return False
-            print(
-                "[PILOT] Executed turn_and_drive:",
-                angle,
-                "° then",
-                distance,
-                "mm at",
-                speed,
-                "units/s with",
-                stop_behavior,
-            )
-            return True
+    try:
+        buffer = _command_buffer
+        bytes_read = 0  # Since the last yield
+        idle = True
+
+        while True:
+            byte = read_input_byte()
+            if byte is None:
+                # No more data available
+                break
 
-        elif action == "arc" and _drivebase:
-            # Arc command: {"action": "arc", "radius": 100, "angle": 90, "speed": 200}
-            # Use Pybricks drivebase arc method for smooth curved movement
-            radius = command.get("radius", 100)
-            angle = command.get("angle")
-            speed = command.get("speed", 100)
-
-            # For mission planning, we might get startAngle/endAngle instead of angle
-            start_angle = command.get("startAngle")
-            end_angle = command.get("endAngle")
-
-            if angle is None and start_angle is not None and end_angle is not None:
-                # Calculate sweep angle from start/end angles
-                angle = end_angle - start_angle
-                # Normalize to [-180, 180] range
-                while angle > 180:
-                    angle -= 360
-                while angle < -180:
-                    angle += 360
-
-            if angle is not None:
-                # Convert stop behavior string to Pybricks Stop parameter
-                stop_param = Stop.HOLD  # Default for arcs
-                stop_behavior = command.get("stop_behavior", "hold")
-                if stop_behavior == "coast_smart":
-                    stop_param = Stop.COAST_SMART
-                elif stop_behavior == "coast":
-                    stop_param = Stop.COAST
-                elif stop_behavior == "brake":
-                    stop_param = Stop.BRAKE
-
-                # Use Pybricks drivebase arc method
-                _drivebase.settings(straight_speed=speed)
-                use_curve = not hasattr(_drivebase, "arc")
-                stalled_arc = await _run_arc_with_stall(
-                    radius,
-                    angle,
-                    stop_param,
-                    use_curve=use_curve,
+            idle = False
+            bytes_read += 1
+            if bytes_read >= _command_read_budget:
+                _command_read_budget = min(
+                    _command_read_budget * 2, _COMMAND_BUFFER_SIZE
                 )
-                if stalled_arc:
+                bytes_read = 0
+                await wait(0)
+
+            if _command_frame_header or _command_frame_remaining:
+                now = get_time_ms()
+                if now - _command_frame_updated > COMMAND_FRAME_TIMEOUT_MS:
+                    # The rest of the frame never came; read this byte afresh
+                    _command_frame_header = 0
+                    _command_frame_remaining = 0
+                    _command_length = 0
+                    print("[PILOT] Dropped incomplete binary frame")
+                else:
+                    _command_frame_updated = now
+
+            if _command_frame_header:
+                # Payload length, little endian, after STX
+                if _command_frame_header == 2:
+                    _command_frame_remaining = byte
+                    _command_frame_header = 1
+                    continue
+                _command_frame_remaining |= byte << 8
+                _command_frame_header = 0
+                if _command_frame_remaining > _COMMAND_BUFFER_SIZE:
+                    _command_frame_remaining = 0
                     _emit_browser_alert(
-                        "DRIVE_STALL",
-                        "Arc movement stalled for over 1s. Command aborted.",
-                    )
-                    print("[PILOT] Arc command aborted due to stall")
-                    return False
-            else:
-                print("[PILOT] Arc command missing angle parameter")
-                return False
-            return True
-
-        elif action == "motor":
-            # Motor command: {"action": "motor", "motor": "left", "angle": 90, "speed": 100}
-            # Also support: {"action": "motor", "port": "A", "speed": 100}
-            motor_name = command.get("motor") or command.get("port")
-            if motor_name and motor_name in _motors:
-                motor = _motors[motor_name]
-                angle = command.get("angle")
-                speed = command.get("speed", 100)
-
-                if angle is not None:
-                    stalled_motor = await _run_motor_angle_with_stall(
-                        motor,
-                        speed,
-                        angle,
+                        "COMMAND_OVERFLOW",
+                        f"Command longer than {_COMMAND_BUFFER_SIZE} bytes was dropped.",
                     )
-                    if stalled_motor:
-                        _emit_browser_alert(
-                            "MOTOR_STALL",
-                            f"Motor '{motor_name}' stalled for over 1s. Command aborted.",
-                        )
-                        print(
-                            "[PILOT] Motor command aborted due to stall for",
-                            motor_name,
-                        )
-                        return False
-                    print(
-                        "[PILOT] Motor '" + motor_name + "':",
-                        angle,
-                        "° at",
-                        speed,
-                        "°/s",
-                    )
-                else:
-                    # Continuous run
-                    await motor.run(speed)
-                    print(
-                        "[PILOT] Motor '" + motor_name + "': running at", speed, "°/s"
+                continue
+
+            if _command_frame_remaining:
+                # Frame payload is opaque: no newline or emergency stop here
+                buffer[_command_length] = byte
+                _command_length += 1
+                _command_frame_remaining -= 1
+                if _command_frame_remaining:
+                    continue
+                length = _command_length
+                _command_length = 0
+                await on_line(bytes(memoryview(buffer)[:length]))
+                continue
+
+            if (
+                byte == COMMAND_FRAME_START
+                and _command_format == "binary"
+                and not _command_length
+                and not _command_discard
+            ):
+                _command_frame_header = 2
+                _command_frame_updated = get_time_ms()
+                continue
+
+            if byte == EMERGENCY_STOP_BYTE:
+                # Act before any buffering or parsing, and drop a half-received
+                # line so it cannot start moving again once it completes
+                emergency_stop()
+                if _command_length or _command_overflow:
+                    _command_discard = True
+                _command_length = 0
+                _command_overflow = False
+                continue
+
+            if byte == 10:  # "\n" completes a command
+                length = _command_length
+                _command_length = 0
+                if _command_discard:
+                    _command_discard = False
+                    _command_overflow = False
+                    continue
+                if _command_overflow:
+                    _command_overflow = False
+                    _emit_browser_alert(
+                        "COMMAND_OVERFLOW",
+                        f"Command longer than {_COMMAND_BUFFER_SIZE} bytes was dropped.",
                     )
-                return True
+                    continue
+                command_text = bytes(memoryview(buffer)[:length]).decode().strip()
+                if command_text:
+                    await on_line(command_text)
+            elif _command_discard:
+                continue
+            elif _command_length < _COMMAND_BUFFER_SIZE:
+                buffer[_command_length] = byte
+                _command_length += 1
             else:
-                print("[PILOT] Unknown motor:", motor_name)
-                return False
+                _command_overflow = True
 
-        elif action == "set_telemetry":
-            # Telemetry control: {"action": "set_telemetry", "enabled": true, "interval": 100}
-            enabled = command.get("enabled", True)
-            interval = command.get("interval")
+        if idle:
+            _command_read_budget = max(_command_read_budget // 2, 64)
 
-            set_telemetry_enabled(enabled)
-            if interval:
-                set_telemetry_interval(interval)
-            return True
+    except Exception as e:
+        print("[PILOT] Command processing error:", e)
 
-        elif action == "reset_drivebase" and _drivebase:
-            # Reset drivebase telemetry: {"action": "reset_drivebase"}
-            try:
-                _drivebase.reset()
-                _hub.imu.reset_heading(0)
-                for motor in _motors:
-                    _motors[motor].reset_angle(0)
-                print("[PILOT] Drivebase telemetry reset - distance and angle set to 0")
-            except Exception as e:
-                print("[PILOT] Drivebase reset error:", e)
-            return True
 
-        elif action == "select_program" and _menu_active:
-            # Select a specific program in the menu: {"action": "select_program", "program_number": 1}
-            program_number = command.get("program_number")
-            if program_number:
-                for i, prog in enumerate(_menu_programs):
-                    if prog["num"] == program_number:
-                        _menu_current_index = i
-                        if _hub:
-                            _hub.display.number(prog["num"])
-                        print("[PILOT:MENU] UI selected:", prog["name"])
-                        _send_menu_status()
-                        break
-            return True
+async def _process_command_line(command_text):
+    """Process a single command line."""
+    try:
+        if _command_debug:
+            print("[PILOT] Received command:", command_text)
 
-        elif action == "run_selected" and _menu_active and _menu_state == "menu":
-            # Run the currently selected program: {"action": "run_selected"}
-            print("[PILOT:MENU] UI requested run")
-            # Note: _run_menu_program is async, we'll need to handle this differently
-            # For now, just set a flag that the menu loop can check
-            global _menu_run_requested
-            _menu_run_requested = True
-            return True
+        # Parse JSON command; binary frames are decoded when they run
+        command = _parse_command(command_text)
+        await _run_command(command, _ack_command(command))
+
+    except Exception as e:
+        print("[PILOT] Command parse/execute error:", e)
+
+
+# Command events and latency
+#
+# A command may carry an "id". Such commands are answered with compact
+# [PILOT:CMD] events, each stamped with hub time in ms:
+#   {"id": 7, "ev": "ack", "t": 1200}               received and parsed
+#   {"id": 7, "ev": "start", "t": 1250, "wait": 50}  left the queue
+#   {"id": 7, "ev": "done", "t": 2250, "dur": 1000}  completed
+#   {"id": 7, "ev": "fail", "t": 2250, "dur": 1000}  refused, stalled or aborted
+# A fail carries "reason": "cancelled" or "dropped" when a stop ended it.
+# Queue wait and execution time of every command, with or without an id,
+# feed per-action histograms for get_command_stats. Each action's histogram
+# is halved once it holds _COMMAND_STATS_WINDOW samples, so it follows
+# recent behaviour rather than the whole session.
+
+_COMMAND_LATENCY_BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+_COMMAND_STATS_WINDOW = 200
+_command_stats = {}  # Action name (or "sequence" for a list) -> statistics
+
+
+def _emit_command_event(command_id, event, timestamp, extra=None):
+    """Print a [PILOT:CMD] event for a command that carries an id."""
+    payload = {"id": command_id, "ev": event, "t": timestamp}
+    if extra:
+        payload.update(extra)
+    print("[PILOT:CMD]", json.dumps(payload))
+
+
+def _command_id(command):
+    """Return the id of a command, or None for lists and commands without one."""
+    if isinstance(command, dict):
+        return command.get("id")
+    if isinstance(command, bytes) and command[0] & _BINARY_ID_FLAG:
+        return struct.unpack_from("<H", command, 1)[0]
+    return None
+
+
+def _command_action(command):
+    """Return the action name a command's statistics are recorded under."""
+    if isinstance(command, dict):
+        return command.get("action")
+    if isinstance(command, bytes):
+        return _binary_action(command)
+    return "sequence"
+
+
+def _ack_command(command):
+    """Acknowledge a parsed command and return its receive time."""
+    received = get_time_ms()
+    command_id = _command_id(command)
+    if command_id is not None:
+        _emit_command_event(command_id, "ack", received)
+    return received
+
+
+def reset_command_stats():
+    """Clear the per-action command latency statistics."""
+    global _command_stats
+    _command_stats = {}
+
+
+def get_command_stats():
+    """Return queue wait and execution time statistics per action."""
+    result = {"buckets": _COMMAND_LATENCY_BUCKETS_MS, "actions": {}}
+    for action in _command_stats:
+        stats = dict(_command_stats[action])
+        count = stats["count"]
+        stats["wait_mean"] = stats["wait_sum"] / count if count else 0
+        stats["exec_mean"] = stats["exec_sum"] / count if count else 0
+        result["actions"][action] = stats
+    return result
+
+
+def _latency_bucket(ms):
+    """Return the histogram slot for a latency in ms."""
+    bucket = 0
+    for bound in _COMMAND_LATENCY_BUCKETS_MS:
+        if ms < bound:
+            break
+        bucket += 1
+    return bucket
+
+
+def _record_command_timing(action, queue_wait, duration, completed):
+    """Add one command to its action's rolling latency histograms."""
+    stats = _command_stats.get(action)
+    if stats is None:
+        slots = len(_COMMAND_LATENCY_BUCKETS_MS) + 1
+        stats = {
+            "count": 0,
+            "failed": 0,
+            "wait_sum": 0,
+            "exec_sum": 0,
+            # Counts for values < each bucket bound, plus one for the rest
+            "wait_histogram": [0] * slots,
+            "exec_histogram": [0] * slots,
+        }
+        _command_stats[action] = stats
+    elif stats["count"] >= _COMMAND_STATS_WINDOW:
+        for key in ("count", "failed", "wait_sum", "exec_sum"):
+            stats[key] //= 2
+        for histogram in (stats["wait_histogram"], stats["exec_histogram"]):
+            for i in range(len(histogram)):
+                histogram[i] //= 2
+    stats["count"] += 1
+    if not completed:
+        stats["failed"] += 1
+    stats["wait_sum"] += queue_wait
+    stats["exec_sum"] += duration
+    stats["wait_histogram"][_latency_bucket(queue_wait)] += 1
+    stats["exec_histogram"][_latency_bucket(duration)] += 1
+
+
+async def _run_command(command, received):
+    """Execute a command, reporting its events and recording its timing."""
+    command_id = _command_id(command)
+    action = _command_action(command)
+    started = get_time_ms()
+    queue_wait = started - received
+    if command_id is not None:
+        _emit_command_event(command_id, "start", started, {"wait": queue_wait})
+
+    # A stop ends the pending motion normally, so compare generations to
+    # tell a stopped command from one that finished
+    generation = _command_generation
+    try:
+        completed = await _execute_command(command)
+    except BaseException:
+        # Cancelled by a stop while running
+        duration = get_time_ms() - started
+        _record_command_timing(action, queue_wait, duration, False)
+        if command_id is not None:
+            _emit_command_event(
+                command_id,
+                "fail",
+                started + duration,
+                {"dur": duration, "reason": "cancelled"},
+            )
+        raise
+
+    duration = get_time_ms() - started
+    cancelled = _command_generation != generation
+    if cancelled:
+        completed = False
+    _record_command_timing(action, queue_wait, duration, completed)
+    if command_id is not None:
+        details = {"dur": duration}
+        if cancelled:
+            details["reason"] = "cancelled"
+        event = "done" if completed else "fail"
+        _emit_command_event(command_id, event, started + duration, details)
+    return completed
+
+
+# Concurrent command execution
+#
+# background_command_task runs a reader and an executor side by side. The
+# reader keeps draining input while a motion runs and appends parsed commands
+# to _command_queue; the executor starts them back to back. A stop skips the
+# queue: the reader runs it at once, and a plain {"action": "stop"} also
+# drops queued commands and cancels the running command or sequence within
+# one COMMAND_POLL_MS tick.
+
+
+def cancel_commands():
+    """Drop queued commands and cancel the running command, if any."""
+    global _command_cancel, _command_generation, _sequence_stream
+
+    _command_generation += 1
+    dropped = _drop_queued_commands()
+    _sequence_stream = None
+    if _command_running:
+        _command_cancel = True
+    if dropped or _command_running:
+        print("[PILOT] Cancelled running command, dropped", dropped, "queued")
+
+
+def _drop_queued_commands():
+    """Empty the command queue, failing queued commands that carry an id."""
+    dropped = len(_command_queue)
+    now = get_time_ms()
+    for command, _ in _command_queue:
+        command_id = _command_id(command)
+        if command_id is not None:
+            _emit_command_event(command_id, "fail", now, {"reason": "dropped"})
+    del _command_queue[:]
+    return dropped
+
+
+def emergency_stop():
+    """Stop the drivebase and every motor now and cancel all pending work.
+
+    Called by the input reader when EMERGENCY_STOP_BYTE arrives. Each device
+    is stopped independently so one failure cannot leave another running.
+    """
+    global _emergency_stop_count
+
+    _emergency_stop_count += 1
+    if _drivebase:
+        try:
+            _drivebase.stop()
+        except Exception as e:
+            print("[PILOT] Emergency stop drivebase error:", e)
+    for name in _motors:
+        try:
+            _motors[name].stop()
+        except Exception as e:
+            print("[PILOT] Emergency stop motor error:", name, e)
+    cancel_commands()
+    _emit_browser_alert(
+        "EMERGENCY_STOP", "Emergency stop received. All motion stopped."
+    )
+
+
+async def _watch_emergency_stop():
+    """Return at the first emergency stop after this starts."""
+    count = _emergency_stop_count
+    while _emergency_stop_count == count:
+        await wait(COMMAND_POLL_MS)
 
+
+async def _queue_command_line(command_text):
+    """Parse a command and queue it, or run it at once if it is a stop."""
+    try:
+        if _command_debug:
+            print("[PILOT] Received command:", command_text)
+
+        command = _parse_command(command_text)
+        if _teleop_enabled:
+            target = _teleop_update(command)
+            if target is not None:
+                _set_teleop_target(target)
+                return
+        received = _ack_command(command)
+        if (
+            isinstance(command, dict)
+            and command.get("action") in _SEQUENCE_STREAM_ACTIONS
+        ):
+            # Chunks bypass the queue so they arrive while the stream runs
+            await _execute_single_command(command)
+            return
+        stop = _stop_kind(command)
+        if stop:
+            if stop == "all":
+                cancel_commands()
+            if isinstance(command, list):
+                # Run [stop] as the stop itself; a cancelled sequence skips it
+                command = command[0]
+            await _run_command(command, received)
         else:
-            print("[PILOT] Unknown command action:", action)
-            return False
+            _command_queue.append((command, received))
 
     except Exception as e:
-        print("[PILOT] Command execution error:", e)
-    return False
+        print("[PILOT] Command parse/execute error:", e)
 
 
-async def process_commands():
-    """Process any incoming commands from stdin using non-blocking read_input_byte."""
-    global _command_buffer
+async def _watch_command_cancel():
+    """Return once the running command has been cancelled."""
+    while not _command_cancel:
+        await wait(COMMAND_POLL_MS)
 
-    try:
-        # Read available bytes one at a time (non-blocking)
-        bytes_read = 0
-        max_bytes_per_call = 50  # Limit bytes read per call to avoid long blocking
 
-        while bytes_read < max_bytes_per_call:
-            try:
-                byte = read_input_byte()
-                if byte is None:
-                    # No more data available
-                    break
+async def _command_reader_task():
+    """Keep reading commands into the queue."""
+    while True:
+        await _read_command_lines(_queue_command_line)
+        await wait(COMMAND_POLL_MS)
 
-                # Convert byte to character and add to buffer
-                char = chr(byte)
-                _command_buffer += char
-                bytes_read += 1
 
-                # Check for complete command (newline terminated)
-                if char == "\n":
-                    # Process complete commands in buffer
-                    await _process_buffered_commands()
+async def _command_executor_task():
+    """Run queued commands back to back, racing each against cancellation."""
+    global _command_running, _command_cancel
 
-            except Exception as e:
-                # Error reading byte, stop reading
-                break
+    while True:
+        # Hold queued commands while a menu program drives the robot
+        if not _command_queue or _menu_state == "running":
+            await wait(COMMAND_POLL_MS)
+            continue
 
-    except Exception as e:
-        print("[PILOT] Command processing error:", e)
+        command, received = _command_queue.pop(0)
+        _command_running = True
+        _command_cancel = False
+        try:
+            results = await multitask(
+                _run_command(command, received), _watch_command_cancel(), race=True
+            )
+            # A command that finished reports True or False; None means the
+            # cancel watcher won the race
+            if results[0] is None:
+                print("[PILOT] Command cancelled")
+        except Exception as e:
+            print("[PILOT] Command execution error:", e)
+        _command_running = False
+        _command_cancel = False
 
 
-async def _process_buffered_commands():
-    """Process all complete commands in the buffer."""
-    global _command_buffer
+def set_program_running(running):
+    """Hold queued remote commands while a user program drives the robot.
 
-    try:
-        # Split buffer by newlines to get complete commands
-        lines = _command_buffer.split("\n")
+    The hub menu does this for its own programs. A generated main that runs
+    the user program next to background_command_task calls it around the
+    program, so UI moves cannot fight it; a stop still runs at once.
+    """
+    global _menu_state
+
+    if running:
+        _menu_state = "running"
+    elif _menu_state == "running":
+        _menu_state = "idle"
+# Teleop streaming
+#
+# With teleop on, the reader does not queue drive_continuous updates. It keeps
+# only the newest target (latest wins, no print, no events), and _teleop_task
+# applies it every _teleop_rate_ms. So a fast joystick stream cannot build
+# a backlog. If no update arrives for _teleop_timeout_ms the drivebase stops
+# (dead-man). Enabling teleop drops queued commands; commands sent later
+# still run, and teleop leaves the drivebase alone while one does. Teleop
+# needs background_command_task.
+
+
+def set_teleop(enabled, rate_ms=None, timeout_ms=None):
+    """Turn teleop streaming on or off, optionally with a new rate and timeout."""
+    global _teleop_enabled, _teleop_rate_ms, _teleop_timeout_ms, _teleop_target
+
+    if rate_ms:
+        _teleop_rate_ms = max(int(rate_ms), COMMAND_POLL_MS)
+    if timeout_ms:
+        _teleop_timeout_ms = int(timeout_ms)
+    enabled = bool(enabled)
+    if enabled and not _teleop_enabled:
+        # Queued moves would fight the stick
+        _drop_queued_commands()
+    if _teleop_enabled and not enabled and _teleop_target is not None:
+        _teleop_drive(0, 0)
+    _teleop_enabled = enabled
+    _teleop_target = None
+    print(
+        "[PILOT] Teleop",
+        "enabled" if enabled else "disabled",
+        "- rate",
+        _teleop_rate_ms,
+        "ms, timeout",
+        _teleop_timeout_ms,
+        "ms",
+    )
 
-        # Keep the last incomplete line in the buffer
-        _command_buffer = lines[-1] if lines else ""
 
-        # Process each complete command (all but the last line)
-        for i in range(len(lines) - 1):
-            command_line = lines[i].strip()
-            if command_line:
-                await _process_command_line(command_line)
+def _teleop_update(command):
+    """Return (speed, turn_rate) if command is a drive_continuous, else None.
 
+    The browser wraps single commands in a list, so [drive_continuous] counts.
+    """
+    if isinstance(command, list) and len(command) == 1:
+        command = command[0]
+    if isinstance(command, dict):
+        if command.get("action") != "drive_continuous":
+            return None
+        return (command.get("speed", 0), command.get("turn_rate", 0))
+    if isinstance(command, bytes) and command[0] & _BINARY_OPCODE_MASK == 0x06:
+        offset = 3 if command[0] & _BINARY_ID_FLAG else 1
+        return struct.unpack_from("<hh", command, offset)
+    return None
+
+
+def _set_teleop_target(target):
+    """Replace the teleop target with the newest update."""
+    global _teleop_target, _teleop_updated
+    _teleop_target = target
+    _teleop_updated = get_time_ms()
+
+
+def _teleop_drive(speed, turn_rate):
+    """Apply a teleop target; a zero target stops the drivebase."""
+    if _drivebase is None:
+        return
+    try:
+        if speed or turn_rate:
+            _drivebase.drive(speed, turn_rate)
+        else:
+            _drivebase.stop()
     except Exception as e:
-        print("[PILOT] Buffer processing error:", e)
+        print("[PILOT] Teleop drive error:", e)
+
+
+async def _teleop_task():
+    """Apply the newest teleop target at the control rate (dead-man stop)."""
+    global _teleop_target
+
+    applied = None
+    while True:
+        await wait(_teleop_rate_ms)
+        if not _teleop_enabled or _command_running or _menu_state == "running":
+            applied = None
+            continue
+        target = _teleop_target
+        if target is None:
+            continue
+        if get_time_ms() - _teleop_updated > _teleop_timeout_ms:
+            _teleop_target = None
+            applied = None
+            _teleop_drive(0, 0)
+            _emit_browser_alert(
+                "TELEOP_TIMEOUT",
+                f"No teleop update for {_teleop_timeout_ms} ms. Drivebase stopped.",
+            )
+            continue
+        if target != applied:
+            _teleop_drive(target[0], target[1])
+            applied = target
 
 
-async def _process_command_line(command_text):
-    """Process a single command line."""
-    try:
-        print("[PILOT] Received command:", command_text)
+async def background_command_task():
+    """Async task that reads and executes commands concurrently.
 
-        # Parse JSON command
-        command = json.loads(command_text)
-        await _execute_command(command)
+    Run it next to the program, e.g.
+    multitask(background_telemetry_task(), background_command_task(), main()).
+    """
+    global _command_executor_active
 
-    except Exception as e:
-        print("[PILOT] Command parse/execute error:", e)
+    _command_executor_active = True
+    try:
+        await multitask(
+            _command_reader_task(),
+            _command_executor_task(),
+            _teleop_task(),
+            stall_monitor_task(),
+        )
+    finally:
+        _command_executor_active = False
 
 
 # Hub menu management functions
@@ -1115,17 +4124,25 @@ async def _run_menu_program():
         _hub.light.on(Color.RED)
 
     try:
-        # Run the program's main function with telemetry
-        await selected["main"]()
-        print("[PILOT:MENU] Program", selected["num"], "completed successfully")
+        # Run the program's main function with telemetry; an emergency stop
+        # aborts it so it cannot drive on after the motors were stopped
+        count = _emergency_stop_count
+        await multitask(selected["main"](), _watch_emergency_stop(), race=True)
+        if _emergency_stop_count != count:
+            print(
+                "[PILOT:MENU] Program", selected["num"], "aborted by emergency stop"
+            )
+        else:
+            print("[PILOT:MENU] Program", selected["num"], "completed successfully")
     except Exception as e:
         print("[PILOT:MENU] Program error:", e)
         if _hub:
             _hub.display.text("ERR")
             wait(2000)
 
-    # Return to menu state
+    # Return to menu state; the program may have changed drivebase settings
     _menu_state = "menu"
+    invalidate_drivebase_settings()
 
     # Auto-advance to next program
     _menu_current_index = (_menu_current_index + 1) % len(_menu_programs)
@@ -1173,12 +4190,21 @@ async def run_hub_menu():
 
     print("[PILOT:MENU] Starting menu loop")
 
+    # UI commands are read and executed by their own tasks, so input keeps
+    # flowing while a command moves the robot
+    await multitask(_hub_menu_loop(), background_command_task(), race=True)
+
+
+async def _hub_menu_loop():
+    """Handle hub buttons and program runs until the menu is closed."""
+    global _menu_run_requested
+
     while _menu_active:
         if _menu_state == "menu":
-            # Process commands (buttons and UI)
-            should_run = await process_menu_commands()
+            _process_menu_buttons()
 
-            if should_run:
+            if _menu_run_requested:
+                _menu_run_requested = False
                 # Run the selected program
                 await _run_menu_program()
 
@@ -1186,6 +4212,84 @@ async def run_hub_menu():
         await wait(50)
 
 
+# Telemetry loop timing
+#
+# background_telemetry_task runs on absolute deadlines spaced
+# _telemetry_interval_ms apart, so collection and print time do not stretch
+# the period. When a frame overruns past the next deadline the loop either
+# skips the missed deadlines ("skip", the default) or runs them back to back
+# ("catch_up", bounded by _TELEMETRY_MAX_CATCH_UP). Lateness (start time minus
+# deadline) and frame duration are accumulated for get_telemetry_stats.
+
+_TELEMETRY_MAX_CATCH_UP = 3  # Deadlines caught up before realigning
+_TELEMETRY_LATENESS_BUCKETS_MS = (1, 2, 5, 10, 20, 50)
+
+
+def set_telemetry_schedule(policy):
+    """Choose how the telemetry loop handles missed deadlines: skip or catch_up."""
+    global _telemetry_schedule
+    if policy not in ("skip", "catch_up"):
+        print("[PILOT] Unknown telemetry schedule:", policy)
+        return
+    _telemetry_schedule = policy
+    print("[PILOT] Telemetry schedule set to", policy)
+
+
+def reset_telemetry_stats():
+    """Clear the telemetry loop timing statistics."""
+    global _telemetry_stats
+    _telemetry_stats = {
+        "ticks": 0,
+        "lateness_min": None,
+        "lateness_max": 0,
+        "lateness_sum": 0,
+        # Counts for lateness < each bucket bound, plus one for the rest
+        "lateness_histogram": [0] * (len(_TELEMETRY_LATENESS_BUCKETS_MS) + 1),
+        "duration_max": 0,
+        "duration_sum": 0,
+        "overruns": 0,
+        "skipped": 0,
+    }
+
+
+def get_telemetry_stats():
+    """Return telemetry loop timing statistics (lateness and frame duration)."""
+    if _telemetry_stats is None:
+        reset_telemetry_stats()
+    stats = dict(_telemetry_stats)
+    ticks = stats["ticks"]
+    stats["lateness_mean"] = stats["lateness_sum"] / ticks if ticks else 0
+    stats["duration_mean"] = stats["duration_sum"] / ticks if ticks else 0
+    stats["lateness_buckets"] = _TELEMETRY_LATENESS_BUCKETS_MS
+    stats["interval"] = _telemetry_interval_ms
+    stats["schedule"] = _telemetry_schedule
+    return stats
+
+
+def _record_telemetry_timing(lateness, duration):
+    """Accumulate one loop iteration into the timing statistics."""
+    if _telemetry_stats is None:
+        reset_telemetry_stats()
+    stats = _telemetry_stats
+    stats["ticks"] += 1
+    if stats["lateness_min"] is None or lateness < stats["lateness_min"]:
+        stats["lateness_min"] = lateness
+    if lateness > stats["lateness_max"]:
+        stats["lateness_max"] = lateness
+    stats["lateness_sum"] += lateness
+    bucket = 0
+    for bound in _TELEMETRY_LATENESS_BUCKETS_MS:
+        if lateness < bound:
+            break
+        bucket += 1
+    stats["lateness_histogram"][bucket] += 1
+    if duration > stats["duration_max"]:
+        stats["duration_max"] = duration
+    stats["duration_sum"] += duration
+    if duration > _telemetry_interval_ms:
+        stats["overruns"] += 1
+
+
 async def background_telemetry_task():
     """
     Async task for continuous background telemetry and command processing.
@@ -1200,12 +4304,30 @@ async def background_telemetry_task():
     )
 
     try:
+        deadline = get_time_ms()
         while True:
-            # Send telemetry data
-            await send_telemetry()
+            now = get_time_ms()
+            if now < deadline:
+                # Wait for the next deadline (async)
+                await wait(deadline - now)
+                now = get_time_ms()
+            else:
+                # Behind schedule: still yield so other tasks can run
+                await wait(0)
 
-            # Wait for the configured interval (async)
-            await wait(_telemetry_interval_ms)
+            # Send telemetry data
+            if _telemetry_enabled:
+                await _send_telemetry_frame(now)
+            _record_telemetry_timing(now - deadline, get_time_ms() - now)
+
+            interval = _telemetry_interval_ms
+            deadline += interval
+            missed = (get_time_ms() - deadline) // interval
+            if missed > 0 and (
+                _telemetry_schedule == "skip" or missed > _TELEMETRY_MAX_CATCH_UP
+            ):
+                deadline += missed * interval
+                _telemetry_stats["skipped"] += missed
     except KeyboardInterrupt:
         print("[PILOT] Parallel telemetry stopped")
     except Exception as e:
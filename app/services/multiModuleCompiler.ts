@@ -176,18 +176,27 @@ print("[PILOT] User module: ${userModuleName}")
 async def main_task():
     """Run the user's main function"""
     print("[PILOT] Starting user program")
+    # Hold UI motion commands while the program drives the robot
+    pilot.set_program_running(True)
     try:
         await main()
     except Exception as e:
         print(f"[PILOT] User program error: {e}")
         # Do not re-raise to keep command/control alive
     finally:
+        pilot.set_program_running(False)
         print("[PILOT] User program completed")
 
-# Run both tasks in parallel
+# Run telemetry, remote commands and the user program in parallel
 print("[PILOT] Starting parallel tasks")
 try:
-    run_task(multitask(pilot.background_telemetry_task(), main_task()))
+    run_task(
+        multitask(
+            pilot.background_telemetry_task(),
+            pilot.background_command_task(),
+            main_task(),
+        )
+    )
 except Exception as e:
     # Never allow unexpected errors to terminate background telemetry
     print(f"[PILOT] Orchestrator error: {e}")
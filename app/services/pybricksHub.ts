@@ -133,6 +133,11 @@ export interface DebugEvent {
   details?: Record<string, unknown>;
 }
 
+// The hub drops command lines longer than its 4096-byte buffer
+// (_COMMAND_BUFFER_SIZE in pybrickspilot.py), so longer sequences are sent
+// in sequence_append chunks of at most this many bytes
+const MAX_COMMAND_LINE_BYTES = 3072;
+
 class PybricksHubService extends EventTarget {
   private device: BluetoothDevice | null = null;
   private server: BluetoothRemoteGATTServer | null = null;
@@ -934,8 +939,41 @@ class PybricksHubService extends EventTarget {
 
   // New command sequence method
   async executeCommandSequence(commands: RobotCommand[]): Promise<void> {
+    const encoder = new TextEncoder();
     const commandSequence = JSON.stringify(commands);
-    await this.sendControlCommand(commandSequence);
+    if (encoder.encode(commandSequence).length <= MAX_COMMAND_LINE_BYTES) {
+      await this.sendControlCommand(commandSequence);
+      return;
+    }
+
+    // Too long for one line: stream it; the hub starts running the first
+    // chunk while the rest arrive
+    await this.sendControlCommand(JSON.stringify({ action: "sequence_begin" }));
+    let chunk: RobotCommand[] = [];
+    let chunkBytes = 0;
+    for (const command of commands) {
+      const commandBytes = encoder.encode(JSON.stringify(command)).length + 1;
+      if (
+        chunk.length > 0 &&
+        chunkBytes + commandBytes > MAX_COMMAND_LINE_BYTES
+      ) {
+        await this.sendControlCommand(
+          JSON.stringify({ action: "sequence_append", commands: chunk }),
+        );
+        chunk = [];
+        chunkBytes = 0;
+      }
+      chunk.push(command);
+      chunkBytes += commandBytes;
+    }
+    if (chunk.length > 0) {
+      await this.sendControlCommand(
+        JSON.stringify({ action: "sequence_append", commands: chunk }),
+      );
+    }
+    await this.sendControlCommand(
+      JSON.stringify({ action: "sequence_commit" }),
+    );
   }
 
   // Compound movement commands
@@ -0,0 +1,147 @@
+"""Tests for app/assets/pybrickspilot.py, run on CPython with fake Pybricks modules.
+
+Run with: python -m pytest tests
+"""
+
+import asyncio
+import json
+import math
+import struct
+import sys
+import time
+import types
+from pathlib import Path
+
+_started = time.monotonic()
+_input = bytearray()
+
+
+class _StopWatch:
+    def time(self):
+        return int((time.monotonic() - _started) * 1000)
+
+
+def _read_input_byte():
+    if _input:
+        return _input.pop(0)
+    return None
+
+
+async def _wait(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def _multitask(*coroutines, race=False):
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    if not race:
+        return list(await asyncio.gather(*tasks))
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return [task.result() if task in done else None for task in tasks]
+
+
+def _install_fake_modules():
+    tools = types.ModuleType("pybricks.tools")
+    tools.StopWatch = _StopWatch
+    tools.read_input_byte = _read_input_byte
+    tools.wait = _wait
+    tools.multitask = _multitask
+    parameters = types.ModuleType("pybricks.parameters")
+    parameters.Color = types.SimpleNamespace(GREEN="GREEN", RED="RED")
+    parameters.Button = types.SimpleNamespace(LEFT=1, RIGHT=2, CENTER=3)
+    parameters.Stop = types.SimpleNamespace(
+        HOLD="HOLD", COAST_SMART="COAST_SMART", COAST="COAST", BRAKE="BRAKE"
+    )
+    pybricks = types.ModuleType("pybricks")
+    pybricks.tools = tools
+    pybricks.parameters = parameters
+    sys.modules.update(
+        {
+            "pybricks": pybricks,
+            "pybricks.tools": tools,
+            "pybricks.parameters": parameters,
+            "ujson": json,
+            "ustruct": struct,
+            "umath": math,
+        }
+    )
+
+
+_install_fake_modules()
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app" / "assets"))
+import pybrickspilot as pilot  # noqa: E402
+
+
+class FakeDriveBase:
+    """Drivebase whose moves take a while and end early when stopped."""
+
+    def __init__(self):
+        self.distance_mm = 0.0
+        self.stops = 0
+
+    def settings(self, *args, **kwargs):
+        return (100, 400, 90, 360)
+
+    def distance(self):
+        return self.distance_mm
+
+    def angle(self):
+        return 0.0
+
+    def state(self):
+        return (self.distance_mm, 100.0, 0.0, 0.0)
+
+    def stalled(self):
+        return False
+
+    def drive(self, speed, turn_rate):
+        pass
+
+    def stop(self):
+        self.stops += 1
+
+    async def straight(self, distance, then=None, wait=True):
+        stops = self.stops
+        for _ in range(100):
+            if self.stops != stops:
+                # Like Pybricks: stopping ends the move without an error
+                return
+            self.distance_mm += distance / 100
+            await asyncio.sleep(0.01)
+
+
+def _command_events(output):
+    prefix = "[PILOT:CMD] "
+    return [
+        json.loads(line[len(prefix) :])
+        for line in output.splitlines()
+        if line.startswith(prefix)
+    ]
+
+
+def test_stop_during_drive_fails_the_drive(capsys):
+    drivebase = FakeDriveBase()
+    pilot.register_drivebase(drivebase)
+
+    async def send_drive_then_stop():
+        _input.extend(b'{"action": "drive", "distance": 500, "id": 1}\n')
+        await asyncio.sleep(0.2)
+        _input.extend(b'{"action": "stop", "id": 2}\n')
+        await asyncio.sleep(0.2)
+
+    async def run():
+        await _multitask(
+            pilot.background_command_task(), send_drive_then_stop(), race=True
+        )
+
+    asyncio.run(run())
+
+    output = capsys.readouterr().out
+    events = {(event["id"], event["ev"]): event for event in _command_events(output)}
+    assert drivebase.stops == 1
+    assert (1, "done") not in events
+    assert events[(1, "fail")]["reason"] == "cancelled"
+    assert (2, "done") in events
+    assert "Executed drive" not in output